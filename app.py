@@ -1,21 +1,34 @@
 # app.py
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Dict, Optional, Any
 import os
 import numpy as np
-import pandas as pd 
 
-from modules.loader import DocxDocLoader, RapidOCRPDFLoader, RapidOCRLoader
+from modules.config import Config
+from modules.loader import DocxDocLoader, RapidOCRPDFLoader, RapidOCRLoader, shutdown_ocr_process_pool
 from modules.embedding import EmbeddingModel
-from modules.vector_db import MilvusHelper
+from modules.embedding_cache import EmbeddingCache
+from modules.vector_db import METADATA_FIELDS, RESERVED_COLLECTION_PREFIX, MilvusHelper, metric_distances
 from modules.table_analysis import TableAnalysis
-from modules.utils import read_file_to_df, save_df_to_pickle
-from modules.model_call import QwenCall, DeepseekCall, GlmCall
+from modules.utils import read_file_to_tables, save_df_to_feather
+from modules.model_call import AsyncLLMClient
+from modules.jobs import Job, JobManager
+from modules.manifest import ManifestStore, chunk_id, content_hash
+from modules.keyword_index import KeywordIndexStore, reciprocal_rank_fusion
+from modules.ocr import ocr_engine_manager
+from modules.index_benchmark import benchmark_collection
+from modules.query_cache import QueryCache
+from modules.semantic_cache import SemanticQueryCache
+from modules.table_registry import TableRegistry
 
+import asyncio
+import heapq
 import tempfile
+import time
+from itertools import islice
 import base64
 
 import json 
@@ -32,18 +45,43 @@ app.add_middleware(
 )
 
 
-# 设置保存pickle文件的路径
-PICKLE_FOLDER = 'pickles'
-if not os.path.exists(PICKLE_FOLDER):
-    os.makedirs(PICKLE_FOLDER)
+# 设置保存上传表格（feather 文件）的路径
+TABLE_FOLDER = 'tables'
+if not os.path.exists(TABLE_FOLDER):
+    os.makedirs(TABLE_FOLDER)
 
 # 初始化 EmbeddingModel 和 MilvusHelper
-embedding_model = EmbeddingModel()
+embedding_cache = EmbeddingCache()
+embedding_model = EmbeddingModel(cache=embedding_cache)
 milvus_helper = MilvusHelper()
+job_manager = JobManager()
+manifest_store = ManifestStore(os.path.join(milvus_helper.db_folder, "manifests"))
+keyword_index_store = KeywordIndexStore(os.path.join(milvus_helper.db_folder, "keyword_index"))
+query_cache = QueryCache()
+semantic_cache = SemanticQueryCache()
+table_registry = TableRegistry(TABLE_FOLDER)
+
+llm_client = AsyncLLMClient()
+
+
+@app.on_event("startup")
+async def startup() -> None:
+    milvus_helper.start_reaper()
+    if Config.OCR_PRELOAD:
+        # 启动时加载 OCR 模型，第一次上传图片不用再等模型初始化
+        await asyncio.to_thread(ocr_engine_manager.warmup)
+
+
+@app.on_event("shutdown")
+async def shutdown() -> None:
+    job_manager.shutdown(wait=False)
+    shutdown_ocr_process_pool()
+    milvus_helper.stop_reaper()
+    milvus_helper.close_all()
+    embedding_cache.close()
+    query_cache.close()
+    await llm_client.close()
 
-qwen = QwenCall()
-deepseek = DeepseekCall()
-glm = GlmCall()
 
 # 存储上传的文本和向量
 uploaded_data = {
@@ -51,112 +89,508 @@ uploaded_data = {
     "embeddings": []
 }
 
+def batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+# 文档名为 * 时搜索数据库中的全部集合
+ALL_COLLECTIONS = "*"
+
+SUPPORTED_DOC_EXTENSIONS = ["doc", "docx", "pdf", "png", "jpg", "jpeg"]
+
+
+def document_cache_tags(db_name: str, doc_file_name: str) -> List[str]:
+    """
+    Cache tags of a document file name spec. A ``*`` search depends on every collection of the database.
+    """
+    if doc_file_name.strip() == ALL_COLLECTIONS:
+        return [f"docs:{db_name}"]
+    return [f"doc:{db_name}/{name.strip()}" for name in doc_file_name.split(",") if name.strip()]
+
+
+async def run_timed(fn, *args, **kwargs):
+    """
+    Run a blocking function on a worker thread, keeping the event loop free for other requests.
+
+    :return: Result of ``fn`` and the seconds it took.
+    """
+    start = time.perf_counter()
+    result = await asyncio.to_thread(fn, *args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def parse_json_param(value: Optional[str], name: str) -> Optional[Dict[str, Any]]:
+    """Parse an optional JSON object passed as a query or form string."""
+    if value is None or not value.strip():
+        return None
+    try:
+        parsed = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in '{name}': {e}")
+    if not isinstance(parsed, dict):
+        raise HTTPException(status_code=400, detail=f"'{name}' must be a JSON object")
+    return parsed
+
+
+def invalidate_query_caches(*tags: str) -> None:
+    """Drop cached /query and /search results computed from any of ``tags``."""
+    query_cache.invalidate(*tags)
+    semantic_cache.invalidate(*tags)
+
+
 @app.post("/upload_file/upload_doc", summary="Upload doc files and split docs into chunks and insert to vector database")
 async def upload_doc(db_name: str = Form(...),
                      chunk_size: int = Form(...),
                      chunk_overlap: int = Form(...),
-                     files: List[UploadFile] = File(...)) -> Dict[str, str]:
+                     files: List[UploadFile] = File(...),
+                     max_workers: int = Form(Config.OCR_MAX_WORKERS)) -> Dict[str, Any]:
     """
-    Upload doc files and split docs into chunks and insert to vector database.
+    Upload doc files and queue them for ingestion. Each file is loaded, split into chunks
+    and inserted to the vector database by a background job; poll ``/jobs/{job_id}`` for progress.
     
     :param db_name: Name of the database.
-    :param collection_name: Name of the collection.
     :param chunk_size: Size of each chunk.
     :param chunk_overlap: Overlap between chunks.
     :param files: List of uploaded files.
-    :return: Dictionary containing a success message.
+    :param max_workers: Number of OCR worker processes a PDF may use at once, 1 to ``Config.OCR_MAX_WORKERS``.
+    :return: Dictionary containing a message and the job id of each file.
     """
-    uploaded_files = []
-    
+    if not 1 <= max_workers <= Config.OCR_MAX_WORKERS:
+        raise HTTPException(status_code=400, detail=f"max_workers must be between 1 and {Config.OCR_MAX_WORKERS}, got {max_workers}")
+    for file in files:
+        file_extension = os.path.splitext(file.filename)[1].lower().lstrip('.')
+        if file_extension not in SUPPORTED_DOC_EXTENSIONS:
+            raise HTTPException(status_code=400, detail=f"{file_extension} type not supported yet, only support {', '.join(SUPPORTED_DOC_EXTENSIONS)} for now")
+        if os.path.splitext(file.filename)[0].startswith(RESERVED_COLLECTION_PREFIX):
+            raise HTTPException(status_code=400, detail=f"File names starting with '{RESERVED_COLLECTION_PREFIX}' are reserved")
+
+    jobs = []
     for file in files:
-        tmp_file_path = None
         try:
-            # Save the uploaded file to a temporary file
+            # Save the uploaded file to a temporary file, the job deletes it when done
             print(f"{file.filename} uploading ")
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                tmp_file.write(await file.read())
-                tmp_file_path = tmp_file.name
-            
-            # Get the file extension from the original filename
-            org_name, file_extension = os.path.splitext(file.filename)
-            file_extension = file_extension.lower().lstrip('.')
-            
-            if file_extension in ["doc", "docx"]:
-                loader = DocxDocLoader(tmp_file_path, file_name=file.filename, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            elif file_extension == "pdf":
-                loader = RapidOCRPDFLoader(tmp_file_path, file_name=file.filename, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            elif file_extension in ['png', 'jpg', 'jpeg']:
-                loader = RapidOCRLoader(file_path=tmp_file_path)
-            else:
-                os.unlink(tmp_file_path)
-                raise HTTPException(status_code=400, detail=f"{file_extension} type not supported yet, only support doc, docx, pdf, png, jpg, jpeg for now")
-            
-            docs = loader.load()
-            
-            # Insert each row of data into the vector database
-            texts = [str(doc.page_content) for doc in docs]
-            embeddings = embedding_model.embed_with_list_of_str(texts)
-            
-            client = milvus_helper.get_milvus_client(db_name)
-            milvus_helper.create_collection(client, org_name)
-            milvus_helper.insert_data(client, org_name, texts, [embedding['embedding'] for embedding in embeddings['output']['embeddings']])
-            
-            # Delete the temporary file
-            os.unlink(tmp_file_path)
-            
-            uploaded_files.append(file.filename)
-            print(f"{file.filename} uploaded")
-        
+            tmp_file_path = await save_upload_to_tempfile(file)
         except Exception as e:
-            # Delete the temporary file if it exists
-            if tmp_file_path and os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
-            raise HTTPException(status_code=400, detail=f"Error loading {file.filename}: {e}")
-    
-    return {"message": f"Files {', '.join(uploaded_files)} uploaded successfully"}
+            raise HTTPException(status_code=400, detail=f"Error saving {file.filename}: {e}")
+
+        job = job_manager.submit(file.filename, ingest_doc_file, tmp_file_path, file.filename, db_name, chunk_size, chunk_overlap, max_workers)
+        jobs.append({"file_name": file.filename, "job_id": job.job_id})
+
+    return {"message": f"Files {', '.join(job['file_name'] for job in jobs)} accepted for processing", "jobs": jobs}
+
+
+@app.get("/jobs/{job_id}", summary="Get progress of a background ingestion job")
+async def get_job(job_id: str) -> Dict[str, Any]:
+    """
+    Get status and stage-level progress of a background ingestion job.
+
+    :param job_id: Id returned by ``/upload_file/upload_doc``.
+    :return: Job status, current stage, progress and result or error.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job.to_dict()
+
+
+async def save_upload_to_tempfile(file: UploadFile) -> str:
+    """
+    Spool an upload to a temporary file in fixed-size chunks, so it is never held in memory whole.
+
+    :param file: Uploaded file.
+    :return: Path of the temporary file. The caller is responsible for deleting it.
+    """
+    tmp_file_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
+            tmp_file_path = tmp_file.name
+            while chunk := await file.read(Config.UPLOAD_CHUNK_SIZE):
+                tmp_file.write(chunk)
+        return tmp_file_path
+    except Exception:
+        if tmp_file_path and os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
+        raise
+
+
+def ingest_doc_file(job: Job, tmp_file_path: str, file_name: str, db_name: str, chunk_size: int, chunk_overlap: int,
+                    max_workers: int = Config.OCR_MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Load, split, embed and insert one uploaded document. Runs on the ingestion worker pool.
+    Chunks are streamed from the loader into a temporary spool file, then embedded and inserted
+    in batches of ``Config.INGEST_BATCH_SIZE``, so memory is bounded by the batch size rather than
+    the document size. The job reports the ``loading``, ``embedding`` and ``inserting`` stages;
+    the last two count progress in chunks, with reused chunks counted as done.
+    On re-upload only chunks missing from the document's manifest are embedded and inserted,
+    unchanged chunks whose position moved only get their metadata rewritten, and chunks no
+    longer present are deleted. The manifest is saved after every written batch, so rows left
+    by a failed run are known to the next one and deleted if no longer needed.
+
+    :param job: Job tracking the progress of this file.
+    :param tmp_file_path: Path of the temporary file holding the upload.
+    :param file_name: Original name of the uploaded file.
+    :param db_name: Name of the database.
+    :param chunk_size: Size of each chunk.
+    :param chunk_overlap: Overlap between chunks.
+    :param max_workers: Number of OCR worker processes for PDF files.
+    :return: Summary of the ingestion.
+    """
+    try:
+        # Get the file extension from the original filename
+        org_name, file_extension = os.path.splitext(file_name)
+        file_extension = file_extension.lower().lstrip('.')
+
+        # PDF 按页汇报加载进度，其他文件按已切出的分块数汇报
+        job.set_stage("loading")
+        if file_extension in ["doc", "docx"]:
+            loader = DocxDocLoader(tmp_file_path, file_name=file_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        elif file_extension == "pdf":
+            loader = RapidOCRPDFLoader(tmp_file_path, file_name=file_name, chunk_size=chunk_size, chunk_overlap=chunk_overlap, progress_callback=job.update, max_workers=max_workers)
+        else:
+            loader = RapidOCRLoader(file_path=tmp_file_path)
+        with manifest_store.lock(db_name, org_name), \
+                tempfile.TemporaryFile("w+", encoding="utf-8") as chunk_spool, \
+                tempfile.TemporaryFile("w+b") as vector_spool:
+            with milvus_helper.writer(db_name) as client:
+                if not manifest_store.exists(db_name, org_name):
+                    # 没有 manifest 的旧集合用的是 0..n-1 的 id，无法增量更新，直接重建
+                    milvus_helper.drop_collection(client, org_name)
+                    keyword_index_store.delete(db_name, org_name)
+                milvus_helper.create_collection(client, org_name)
+            old_chunks = manifest_store.load(db_name, org_name)
+            old_positions = manifest_store.load_positions(db_name, org_name)
+            keyword_index = keyword_index_store.get(db_name, org_name)
+            new_chunks = {}
+            positions = {}
+            occurrences = {}
+            moved = []
+            recomputed = 0
+
+            # 新的或改变了的分块先写到临时文件，加载完才知道分块总数
+            for doc in loader.lazy_load():
+                text = str(doc.page_content)
+                chunk_hash = content_hash(text)
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                chunk_key = chunk_id(chunk_hash, occurrence)
+                chunk_index = len(new_chunks)
+                new_chunks[chunk_key] = chunk_hash
+                # 关键词索引里缺的分块（包括建索引之前入库的）都补上
+                keyword_index.add(chunk_key, text)
+                positions[chunk_key] = [file_name, doc.metadata.get("page", 0), chunk_index]
+                if chunk_key not in old_chunks:
+                    metadata = {"source": file_name, "page": doc.metadata.get("page", 0),
+                                "chunk_index": chunk_index, "content_hash": chunk_hash}
+                    chunk_spool.write(json.dumps({"id": chunk_key, "text": text, "metadata": metadata}) + "\n")
+                    recomputed += 1
+                elif old_positions.get(chunk_key) != positions[chunk_key]:
+                    # 内容没变但前面插入或删除了内容，只改写页码和序号，不重新向量化
+                    moved.append(chunk_key)
+                if file_extension != "pdf":
+                    job.advance()
+            reused = len(new_chunks) - recomputed
+            job.count("chunks_reused", reused)
+
+            def spooled_batches():
+                chunk_spool.seek(0)
+                for batch in batched(map(json.loads, chunk_spool), Config.INGEST_BATCH_SIZE):
+                    yield [chunk["id"] for chunk in batch], [chunk["text"] for chunk in batch], [chunk["metadata"] for chunk in batch]
+
+            # Embed only new or changed chunks, batch by batch
+            job.set_stage("embedding", total=len(new_chunks))
+            job.update(reused)
+            for _, texts, _ in spooled_batches():
+                vectors, usage = embedding_model.embed(texts)
+                vector_spool.write(vectors.tobytes())
+                job.count("chunks_embedded", len(texts))
+                job.count("embedding_tokens", usage["total_tokens"])
+                job.advance(len(texts))
+
+            job.set_stage("inserting", total=len(new_chunks))
+            job.update(reused - len(moved))
+            vector_spool.seek(0)
+            row_bytes = embedding_model.dimension * np.dtype(np.float32).itemsize
+            # 已写入集合的分块，每批写完都保存为 manifest，中途失败时下次上传也能找到并清理它们
+            written_chunks = dict(old_chunks)
+            written_positions = dict(old_positions)
+            for ids, texts, metadatas in spooled_batches():
+                vectors = np.frombuffer(vector_spool.read(len(texts) * row_bytes), dtype=np.float32).reshape(len(texts), -1)
+                with milvus_helper.writer(db_name) as client:
+                    milvus_helper.insert_data(client, org_name, texts, vectors, ids, metadatas)
+                for chunk_key in ids:
+                    written_chunks[chunk_key] = new_chunks[chunk_key]
+                    written_positions[chunk_key] = positions[chunk_key]
+                manifest_store.save(db_name, org_name, written_chunks, written_positions)
+                job.count("chunks_inserted", len(texts))
+                job.advance(len(texts))
+            for ids in batched(moved, Config.INGEST_BATCH_SIZE):
+                metadatas = [{"source": positions[chunk_key][0], "page": positions[chunk_key][1],
+                              "chunk_index": positions[chunk_key][2], "content_hash": new_chunks[chunk_key]}
+                             for chunk_key in ids]
+                with milvus_helper.writer(db_name) as client:
+                    milvus_helper.update_metadata(client, org_name, ids, metadatas)
+                for chunk_key in ids:
+                    written_positions[chunk_key] = positions[chunk_key]
+                manifest_store.save(db_name, org_name, written_chunks, written_positions)
+                job.count("chunks_moved", len(ids))
+                job.advance(len(ids))
+
+            # Delete chunks that are no longer in the document
+            removed = [chunk_key for chunk_key in old_chunks if chunk_key not in new_chunks]
+            with milvus_helper.writer(db_name) as client:
+                milvus_helper.delete_data(client, org_name, removed)
+            keyword_index.remove([chunk_key for chunk_key in keyword_index.ids() if chunk_key not in new_chunks])
+            keyword_index.flush()
+            manifest_store.save(db_name, org_name, new_chunks, positions)
+
+        print(f"{file_name} uploaded")
+        result = {"collection_name": org_name, "chunks": len(new_chunks), "reused": reused,
+                  "recomputed": recomputed, "moved": len(moved), "deleted": len(removed)}
+        if getattr(loader, "ocr_stats", None):
+            result["ocr"] = loader.ocr_stats
+        return result
+    finally:
+        # 无论成功与否集合都可能已经改变，丢弃依赖它的缓存查询结果
+        invalidate_query_caches(f"doc:{db_name}/{org_name}", f"docs:{db_name}")
+        # Delete the temporary file
+        if os.path.exists(tmp_file_path):
+            os.unlink(tmp_file_path)
+
 
 @app.get("/search")
-async def search(db_name: str, collection_name: str, query: str, top_k: int = 5) -> Dict[str, Any]:
+async def search(db_name: str, query: str, collection_name: Optional[str] = None, top_k: int = 5,
+                 search_params: Optional[str] = None) -> Dict[str, Any]:
     """
     Search in the vector database.
 
     :param db_name: Name of the database.
-    :param collection_name: Name of the collection.
+    :param collection_name: Name of the collection, several names separated by commas, or ``*``.
+        All collections of the database are searched when omitted.
     :param query: Query string.
     :param top_k: Number of top results to return.
+    :param search_params: JSON object of index search params (e.g. ``{"ef": 128}``) overriding the collection defaults.
     :return: Search results.
     """
-    return {"document_result": process_document_file(query, db_name, collection_name)}
+    doc_file_name = collection_name or ALL_COLLECTIONS
+    params = parse_json_param(search_params, "search_params")
+    cache_key = QueryCache.make_key("search", query, db_name=db_name, doc_file_name=doc_file_name, top_k=top_k,
+                                    search_params=params)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    generation = query_cache.generation
+    # 向量化和检索都是阻塞调用，放到线程里执行，不占用事件循环
+    document_result = await asyncio.to_thread(process_document_file, query, db_name, doc_file_name, top_k,
+                                              search_params=params)
+    response = {"document_result": document_result}
+    query_cache.put(cache_key, response, document_cache_tags(db_name, doc_file_name), generation)
+    return response
+
+
+@app.post("/search/batch", summary="Search the vector database with many queries in one request")
+async def search_batch(db_name: str = Form(...),
+                       queries: List[str] = Form(...),
+                       collection_name: Optional[str] = Form(None),
+                       top_k: int = Form(5),
+                       search_params: Optional[str] = Form(None)) -> Dict[str, Any]:
+    """
+    Search in the vector database with a batch of queries. The queries are embedded in as few
+    DashScope batches as possible and looked up with a single vector search.
+
+    :param db_name: Name of the database.
+    :param queries: Query strings.
+    :param collection_name: Name of the collection, several names separated by commas, or ``*``.
+        All collections of the database are searched when omitted.
+    :param top_k: Number of top results to return per query.
+    :param search_params: JSON object of index search params overriding the collection defaults.
+    :return: Search results of each query, in the order of ``queries``.
+    """
+    if len(queries) > Config.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {Config.SEARCH_BATCH_MAX_QUERIES} queries per batch, got {len(queries)}")
+    params = parse_json_param(search_params, "search_params")
+    results = await asyncio.to_thread(process_document_queries, queries, db_name, collection_name or ALL_COLLECTIONS, top_k,
+                                      search_params=params)
+    return {"results": [{"query": query, "document_result": result} for query, result in zip(queries, results)]}
+
+
+@app.get("/collections/index", summary="Get the vector index settings of a collection")
+async def get_collection_index(db_name: str, collection_name: str) -> Dict[str, Any]:
+    """
+    Get the index type, metric, index build params and default search params of a collection.
+
+    :param db_name: Name of the database.
+    :param collection_name: Name of the collection.
+    :return: Index settings.
+    """
+    client = milvus_helper.get_milvus_client(db_name)
+    if not client.has_collection(collection_name):
+        raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found in '{db_name}'")
+    return milvus_helper.get_index_settings(client, collection_name)
+
+
+@app.post("/collections/index", summary="Change the vector index settings of a collection")
+async def set_collection_index(db_name: str = Form(...),
+                               collection_name: str = Form(...),
+                               index_type: Optional[str] = Form(None),
+                               metric_type: Optional[str] = Form(None),
+                               index_params: Optional[str] = Form(None),
+                               search_params: Optional[str] = Form(None)) -> Dict[str, Any]:
+    """
+    Change the vector index of a collection (e.g. FLAT, IVF_FLAT, HNSW) and its default search params.
+    The settings are stored with the collection; the index is rebuilt when its type, metric or build
+    params change.
+
+    :param db_name: Name of the database.
+    :param collection_name: Name of the collection.
+    :param index_type: Index type, unchanged when omitted.
+    :param metric_type: COSINE, IP or L2, unchanged when omitted.
+    :param index_params: JSON object of index build params, e.g. ``{"M": 16, "efConstruction": 200}``.
+    :param search_params: JSON object of default search params, e.g. ``{"ef": 64}``.
+    :return: The new index settings.
+    """
+    parsed_index_params = parse_json_param(index_params, "index_params")
+    parsed_search_params = parse_json_param(search_params, "search_params")
+
+    def apply():
+        with milvus_helper.writer(db_name) as client:
+            if not client.has_collection(collection_name):
+                raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found in '{db_name}'")
+            return milvus_helper.set_index(client, collection_name, index_type, metric_type,
+                                           parsed_index_params, parsed_search_params)
+
+    try:
+        settings = await asyncio.to_thread(apply)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error changing index of '{collection_name}': {e}")
+    finally:
+        invalidate_query_caches(f"doc:{db_name}/{collection_name}", f"docs:{db_name}")
+    return settings
+
+
+@app.post("/collections/index/benchmark", summary="Compare recall@k and latency of vector index settings on a collection")
+async def benchmark_collection_index(db_name: str = Form(...),
+                                     collection_name: str = Form(...),
+                                     top_k: int = Form(10),
+                                     num_queries: int = Form(100),
+                                     settings: Optional[str] = Form(None)) -> Dict[str, Any]:
+    """
+    Build each index setting on a temporary copy of a collection and report recall@k against exact
+    search and per-query latency for each search param. The collection itself is not modified.
+
+    :param db_name: Name of the database.
+    :param collection_name: Name of the collection.
+    :param top_k: Number of neighbours per query.
+    :param num_queries: Number of stored vectors sampled as queries.
+    :param settings: JSON list of ``{"index_type", "index_params", "search_params": [...]}`` to compare,
+        defaults to FLAT, IVF_FLAT and HNSW with a few search params each.
+    :return: One row per index setting and search params.
+    """
+    try:
+        parsed_settings = json.loads(settings) if settings else None
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON in 'settings': {e}")
+
+    def run():
+        with milvus_helper.writer(db_name) as client:
+            if not client.has_collection(collection_name):
+                raise HTTPException(status_code=404, detail=f"Collection '{collection_name}' not found in '{db_name}'")
+            return benchmark_collection(milvus_helper, client, collection_name, parsed_settings, top_k, num_queries)
+
+    try:
+        results = await asyncio.to_thread(run)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"collection_name": collection_name, "results": results}
+
+
+@app.get("/stats/embedding_cache", summary="Embedding cache hit/miss statistics")
+async def embedding_cache_stats() -> Dict[str, Any]:
+    """
+    Report hit/miss counters of the on-disk embedding cache.
+
+    :return: Cache statistics.
+    """
+    return embedding_cache.stats()
+
+
+@app.get("/stats/ocr", summary="OCR engine load and inference statistics")
+async def ocr_stats() -> Dict[str, Any]:
+    """
+    Report model-load time and per-image inference time of the shared OCR engines.
+
+    :return: OCR engine statistics.
+    """
+    return ocr_engine_manager.stats()
+
+
+@app.get("/stats/query_cache", summary="Query result cache hit/miss statistics")
+async def query_cache_stats() -> Dict[str, Any]:
+    """
+    Report hit/miss counters of the /query and /search result cache.
+
+    :return: Cache statistics.
+    """
+    return query_cache.stats()
+
+
+@app.get("/stats/semantic_cache", summary="Semantic query cache hit/miss statistics")
+async def semantic_cache_stats() -> Dict[str, Any]:
+    """
+    Report hit/miss counters of the /query semantic answer cache.
+
+    :return: Cache statistics.
+    """
+    return semantic_cache.stats()
+
+
+@app.get("/stats/llm", summary="Per-provider LLM latency and token statistics")
+async def llm_stats() -> Dict[str, Any]:
+    """
+    Report request, retry, hedge and failover counters, latency and token usage of each LLM provider.
+
+    :return: Statistics keyed by provider name.
+    """
+    return llm_client.stats()
 
 
-@app.post("/upload_file/upload_excel_or_csv", summary="Upload Excel or CSV file and save as pickle")
-async def upload_excel_or_csv(file: UploadFile = File(...)) -> Dict[str, str]:
+@app.get("/stats/table_registry", summary="In-memory table cache statistics")
+async def table_registry_stats() -> Dict[str, Any]:
     """
-    Upload an Excel or CSV file, convert to DataFrame, and save as pickle file.
+    Report hits, loads, evictions and memory use of the in-memory table cache.
+
+    :return: Statistics of the table registry.
+    """
+    return table_registry.stats()
+
+
+@app.post("/upload_file/upload_excel_or_csv", summary="Upload Excel or CSV file and save as a Feather table")
+async def upload_excel_or_csv(file: UploadFile = File(...)) -> Dict[str, Any]:
+    """
+    Upload an Excel or CSV file, convert to DataFrame, and save as an uncompressed Feather file
+    that queries memory-map and read column by column. The file is read in chunks with compact
+    column types; every sheet of a workbook becomes its own table.
     
     :param file: Uploaded Excel or CSV file.
-    :return: Dictionary containing a success message.
+    :return: Dictionary containing a success message and the read statistics of each table.
     """
     tmp_file_path = None
     try:
         # Save the uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-            tmp_file.write(await file.read())
-            tmp_file_path = tmp_file.name
+        tmp_file_path = await save_upload_to_tempfile(file)
         
         _, file_extension = os.path.splitext(file.filename)
-        # Read the file into DataFrame
-        df = read_file_to_df(tmp_file_path, file_extension)
         # Get the original file name without extension
         file_name = os.path.splitext(file.filename)[0]
-        
-        # Save DataFrame to pickle file
-        save_df_to_pickle(df, file_name, PICKLE_FOLDER)
+        tables = await asyncio.to_thread(ingest_table_file, tmp_file_path, file_name, file_extension)
         
         # Delete the temporary file
         os.unlink(tmp_file_path)
 
-        return {"message": f"File '{file.filename}' has been uploaded and saved as pickle."}
+        return {"message": f"File '{file.filename}' has been uploaded and saved as a table.", "tables": tables}
     
     except Exception as e:
         # Delete the temporary file if it exists
@@ -165,104 +599,304 @@ async def upload_excel_or_csv(file: UploadFile = File(...)) -> Dict[str, str]:
         raise HTTPException(status_code=400, detail=f"Error processing {file.filename}: {e}")
     
 
-@app.post("/query", summary="Query with table and document")
-async def query_table_and_document(query: str = Form(...), 
-                                   db_name: str = Form(...),
-                                   table_file_name: Optional[str] = Form(None), 
-                                   doc_file_name: Optional[str] = Form(None)) -> Dict[str, Any]:
+def query_cache_state(query: str, db_name: str, table_file_name: Optional[str], doc_file_name: Optional[str]) -> Dict[str, Any]:
     """
-    Query with a table and document file name. If table_file_name is provided, use TableAnalysis.
-    If doc_file_name is provided, search in the vector database.
-
-    :param query: Query string.
-    :param table_file_name: Name of the table file in pickles folder.
-    :param doc_file_name: Name of the document file in vector database.
-    :return: Combined result from table analysis and document search.
+    Cache key, tags and invalidation generations of a /query request, captured before it is computed.
     """
-    final_result = {}
-    import time 
-    start_time = time.time()
-    # Process table file if provided
+    tags = []
     if table_file_name:
-        final_result['table_result'] = process_table_file(query, table_file_name)
+        tags.append(f"table:{table_file_name}")
+    if doc_file_name:
+        tags.extend(document_cache_tags(db_name, doc_file_name))
+    return {
+        "key": QueryCache.make_key("query", query, db_name=db_name, table_file_name=table_file_name, doc_file_name=doc_file_name),
+        "tags": tags,
+        "generation": query_cache.generation,
+        "semantic_source": (db_name, table_file_name, doc_file_name),
+        "semantic_generation": semantic_cache.generation,
+    }
+
+
+async def embed_for_query(query: str, doc_file_name: Optional[str], timings: Dict[str, float]) -> Optional[np.ndarray]:
+    """
+    Embed a /query request once for document search and the semantic cache.
+
+    :return: Query embedding, or None when neither needs it or, for queries without documents,
+        when embedding failed; the semantic cache is then skipped.
+    """
+    if not doc_file_name and not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    try:
+        query_vectors, timings['embedding'] = await run_timed(embed_queries, [query])
+    except HTTPException as e:
+        if doc_file_name:
+            raise
+        # 只查表格时向量只用于语义缓存，嵌入失败不影响回答
+        print(f"Warning: skipping semantic cache for '{query}': {e.detail}")
+        return None
+    return query_vectors[0]
+
+
+def lookup_semantic_cache(query: str, cache_state: Dict[str, Any], query_vector: Optional[np.ndarray]) -> Optional[Dict[str, Any]]:
+    if query_vector is None or not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+    hit = semantic_cache.get(cache_state["semantic_source"], query, query_vector)
+    if hit is None:
+        return None
+    print(f"Semantic cache hit: '{query}' ~ '{hit['query']}' (distance {hit['distance']:.3f})")
+    return {**hit['response'], "query": query}
+
+
+def store_query_response(query: str, query_vector: Optional[np.ndarray], cache_state: Dict[str, Any], response: Dict[str, Any]) -> None:
+    query_cache.put(cache_state["key"], response, cache_state["tags"], cache_state["generation"])
+    if query_vector is None or not Config.SEMANTIC_CACHE_ENABLED:
+        return
+    semantic_cache.put(cache_state["semantic_source"], query, query_vector, response, cache_state["tags"],
+                       cache_state["semantic_generation"])
+
+
+async def retrieve_for_query(query: str, db_name: str, table_file_name: Optional[str], doc_file_name: Optional[str],
+                             query_vector: Optional[np.ndarray], timings: Dict[str, float]) -> Dict[str, str]:
+    """
+    Process table file and document file, if provided, concurrently on worker threads.
 
-    # Process document file if provided
+    :param timings: Seconds spent in each branch are recorded here.
+    :return: Table and document results keyed ``table_result`` and ``document_result``.
+    """
+    branches = []
+    if table_file_name:
+        branches.append(("table", run_timed(process_table_file, query, table_file_name)))
     if doc_file_name:
-        final_result['document_result'] = process_document_file(query, db_name, doc_file_name)
+        branches.append(("document", run_timed(process_document_file, query, db_name, doc_file_name, query_vector=query_vector)))
 
-    final_result_time = time.time()
-    print(f"Time to generate tools result: {final_result_time - start_time} seconds")
+    final_result = {}
+    for (name, _), (result, elapsed) in zip(branches, await asyncio.gather(*(branch for _, branch in branches))):
+        final_result[f"{name}_result"] = result
+        timings[name] = elapsed
     print(final_result)
+    return final_result
+
+
+def load_table_image(final_result: Dict[str, str]) -> Optional[str]:
+    """
+    :return: Base64 encoded chart when table analysis produced one, otherwise None.
+    """
     table_result = final_result.get("table_result")
-    
+
     if table_result and table_result.startswith('"') and table_result.endswith('"'):
         table_result = json.loads(table_result)
 
     if table_result and table_result.endswith(".png"):
         with open(table_result, "rb") as image_file:
-            base64_encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-        return {"query": query, "answer": None, "results": None, "image": base64_encoded_image}
-    
+            return base64.b64encode(image_file.read()).decode('utf-8')
+    return None
+
+
+@app.post("/query", summary="Query with table and document")
+async def query_table_and_document(query: str = Form(...), 
+                                   db_name: str = Form(...),
+                                   table_file_name: Optional[str] = Form(None), 
+                                   doc_file_name: Optional[str] = Form(None),
+                                   no_cache: bool = Form(False)) -> Dict[str, Any]:
+    """
+    Query with a table and document file name. If table_file_name is provided, use TableAnalysis.
+    If doc_file_name is provided, search in the vector database. Both run concurrently on worker
+    threads and the seconds spent in each step are returned in ``timings``.
+    Answers are cached; a query close enough in meaning to an earlier one on the same data
+    is answered from the semantic cache without calling TableAnalysis or the LLM.
+
+    :param query: Query string.
+    :param table_file_name: Name of the table file in tables folder.
+    :param doc_file_name: Name of the document file in vector database, several names separated by commas,
+        or ``*`` to search every document in the database.
+    :param no_cache: Skip cache lookups and compute a fresh answer, which then replaces the cached one.
+    :return: Combined result from table analysis and document search, with per-step timings.
+    """
+    cache_state = query_cache_state(query, db_name, table_file_name, doc_file_name)
+    if not no_cache:
+        cached = query_cache.get(cache_state["key"])
+        if cached is not None:
+            return cached
+
+    # 文档检索也要用到查询向量，这里只算一次
+    timings = {}
+    query_vector = await embed_for_query(query, doc_file_name, timings)
+    if not no_cache:
+        cached = lookup_semantic_cache(query, cache_state, query_vector)
+        if cached is not None:
+            return cached
+
+    final_result = await retrieve_for_query(query, db_name, table_file_name, doc_file_name, query_vector, timings)
+
+    image = load_table_image(final_result)
+    if image:
+        response = {"query": query, "answer": None, "results": None, "image": image, "timings": timings}
     else:
         from prompts.final_answer_prompt import final_answer_prompt
         prompt = final_answer_prompt.format(query=query, final_result=final_result)
-        # answer = deepseek.get_response(prompt)
-        answer = qwen.get_response(prompt)
-        # answer = glm.get_response(prompt)
+        answer_start = time.perf_counter()
+        try:
+            answer = await llm_client.get_response(prompt)
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Error generating answer: {e}")
+        timings['answer'] = time.perf_counter() - answer_start
+
+        response = {"query": query, "answer": answer, "results": final_result, "image": None, "timings": timings}
+
+    store_query_response(query, query_vector, cache_state, response)
+    return response
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
 
-        output_time = time.time()
-        print(f"Time to get response from model Call: {output_time - final_result_time} seconds")
+@app.post("/query/stream", summary="Query with table and document, streaming the answer as Server-Sent Events")
+async def query_table_and_document_stream(query: str = Form(...),
+                                          db_name: str = Form(...),
+                                          table_file_name: Optional[str] = Form(None),
+                                          doc_file_name: Optional[str] = Form(None),
+                                          no_cache: bool = Form(False)) -> StreamingResponse:
+    """
+    Streaming variant of ``/query``. Emits a ``results`` event as soon as table analysis and
+    document search are done, then the answer as ``token`` events while the LLM generates it,
+    and finally a ``done`` event with the full answer and per-step timings. Charts produced by
+    table analysis are sent in an ``image`` event instead of an answer. Failures after the stream
+    started are reported in an ``error`` event.
+
+    :param query: Query string.
+    :param table_file_name: Name of the table file in tables folder.
+    :param doc_file_name: Name of the document file in vector database, several names separated by commas,
+        or ``*`` to search every document in the database.
+    :param no_cache: Skip cache lookups and compute a fresh answer, which then replaces the cached one.
+    :return: ``text/event-stream`` response.
+    """
+    start = time.perf_counter()
+    cache_state = query_cache_state(query, db_name, table_file_name, doc_file_name)
+    cached = None if no_cache else query_cache.get(cache_state["key"])
+    if cached is None:
+        timings = {}
+        query_vector = await embed_for_query(query, doc_file_name, timings)
+        if not no_cache:
+            cached = lookup_semantic_cache(query, cache_state, query_vector)
+    # 检索放在开始推送之前，出错时仍然能返回正常的 HTTP 状态码
+    if cached is None:
+        final_result = await retrieve_for_query(query, db_name, table_file_name, doc_file_name, query_vector, timings)
 
-        return {"query": query, "answer": answer, "results": final_result, "image": None}
+    async def events():
+        if cached is not None:
+            yield sse_event("results", {"query": query, "results": cached["results"]})
+            if cached["image"]:
+                yield sse_event("image", {"image": cached["image"]})
+            else:
+                yield sse_event("token", {"content": cached["answer"]})
+            yield sse_event("done", {"answer": cached["answer"], "timings": cached.get("timings"), "cached": True})
+            return
 
+        yield sse_event("results", {"query": query, "results": final_result, "timings": dict(timings)})
+        image = load_table_image(final_result)
+        if image:
+            yield sse_event("image", {"image": image})
+            yield sse_event("done", {"answer": None, "timings": timings, "cached": False})
+            store_query_response(query, query_vector, cache_state,
+                                 {"query": query, "answer": None, "results": None, "image": image, "timings": timings})
+            return
 
-@app.delete("/delete_data", summary="Delete all files in milvus_db and pickles")
+        from prompts.final_answer_prompt import final_answer_prompt
+        prompt = final_answer_prompt.format(query=query, final_result=final_result)
+        answer_start = time.perf_counter()
+        parts = []
+        try:
+            async for content in llm_client.stream_response(prompt):
+                if not parts:
+                    timings['first_token'] = time.perf_counter() - start
+                parts.append(content)
+                yield sse_event("token", {"content": content})
+        except Exception as e:
+            yield sse_event("error", {"detail": f"Error generating answer: {e}"})
+            return
+        timings['answer'] = time.perf_counter() - answer_start
+
+        answer = "".join(parts)
+        yield sse_event("done", {"answer": answer, "timings": timings, "cached": False})
+        store_query_response(query, query_vector, cache_state,
+                             {"query": query, "answer": answer, "results": final_result, "image": None, "timings": timings})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.delete("/delete_data", summary="Delete all files in milvus_db and tables")
 async def delete_all_data() -> Dict[str, str]:
     """
-    Delete all files in milvus_db and pickles folders.
+    Delete all files in milvus_db and tables folders.
     
     :return: Dictionary containing a success message.
     """
     try:
-        # Delete all files in pickles folder
-        milvus_folder = "milvus_db"
+        # Close open clients before their database files are removed
+        milvus_helper.close_all()
+
+        # Delete all files in milvus_db folder
+        milvus_folder = milvus_helper.db_folder
         for file in os.listdir(milvus_folder):
             file_path = os.path.join(milvus_folder, file)
             if os.path.isfile(file_path):
                 os.remove(file_path)
+        manifest_store.clear()
+        keyword_index_store.clear()
+        query_cache.clear()
+        semantic_cache.clear()
+        table_registry.clear()
 
-        # Delete all files in pickles folder
-        for file in os.listdir(PICKLE_FOLDER):
-            file_path = os.path.join(PICKLE_FOLDER, file)
+        # Delete all files in tables folder
+        for file in os.listdir(TABLE_FOLDER):
+            file_path = os.path.join(TABLE_FOLDER, file)
             if os.path.isfile(file_path):
                 os.remove(file_path)
 
-        return {"message": "All data in milvus_db and pickles folders have been deleted."}
+        return {"message": "All data in milvus_db and tables folders have been deleted."}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting data: {e}")
 
 
+def ingest_table_file(tmp_file_path: str, file_name: str, file_extension: str) -> List[Dict[str, Any]]:
+    """
+    Read an uploaded spreadsheet and save each of its sheets as a table.
+    The first sheet is saved as ``file_name``, further sheets as ``{file_name}-{sheet name}``.
+
+    :param tmp_file_path: Path of the temporary file holding the upload.
+    :param file_name: Original file name without extension.
+    :param file_extension: Extension of the original file.
+    :return: Table name, sheet and read statistics (rows per second, memory saved) of each saved table.
+    """
+    tables = []
+    for i, (sheet_name, (df, stats)) in enumerate(read_file_to_tables(tmp_file_path, file_extension).items()):
+        table_name = file_name if i == 0 else f"{file_name}-{sheet_name}"
+        # Save DataFrame to Feather file
+        save_df_to_feather(df, table_name, TABLE_FOLDER)
+        table_registry.invalidate(table_name)
+        invalidate_query_caches(f"table:{table_name}")
+        print(f"{table_name}: {stats['rows']} rows at {stats['rows_per_second']} rows/s, "
+              f"{stats['bytes']} bytes in memory vs {stats['naive_bytes']} naive")
+        tables.append({"table_name": table_name, "sheet_name": sheet_name, **stats})
+    return tables
+
+
 def process_table_file(query: str, table_file_name: str) -> str:
     """
     Process table file for the given query and return the result as a JSON string.
 
     :param query: Query string.
-    :param table_file_name: Name of the table file in pickles folder.
+    :param table_file_name: Name of the table file in tables folder.
     :return: JSON string result from table analysis.
     """
     try:
-        pickle_path = os.path.join(PICKLE_FOLDER, f"{table_file_name}.pkl")
-
-        if not os.path.exists(pickle_path):
-            raise HTTPException(status_code=404, detail=f"Pickle file '{table_file_name}.pkl' not found")
+        if not table_registry.exists(table_file_name):
+            raise HTTPException(status_code=404, detail=f"Table '{table_file_name}' not found")
 
-        # Load DataFrame from pickle file
-        df = pd.read_pickle(pickle_path)
-        for column in df.select_dtypes(include=['datetime', 'datetimetz']):
-            df[column] = df[column].apply(lambda x: x.strftime('%Y-%m-%d %H:%M:%S') if not pd.isna(x) else '')
-
-        ta_chat = TableAnalysis(df)
+        # Columns are read from the memory-mapped Feather file only when a tool needs them, then kept in memory
+        ta_chat = TableAnalysis(table_registry.view(table_file_name))
         table_result = ta_chat.call_with_messages(query)
 
         return json.dumps(table_result, ensure_ascii=False)
@@ -271,33 +905,157 @@ def process_table_file(query: str, table_file_name: str) -> str:
         raise HTTPException(status_code=400, detail=f"Error processing table file '{table_file_name}': {e}")
     
 
-def process_document_file(query: str, db_name: str, doc_file_name: str) -> str:
+def parse_collection_names(client, doc_file_name: str) -> List[str]:
+    """
+    Resolve a document file name spec into collection names.
+
+    :param client: Milvus client of the database.
+    :param doc_file_name: A collection name, several names separated by commas, or ``*`` for all collections.
+    :return: Collection names to search.
+    """
+    if doc_file_name.strip() == ALL_COLLECTIONS:
+        return milvus_helper.list_collections(client)
+    return [name.strip() for name in doc_file_name.split(",") if name.strip()]
+
+
+def process_document_file(query: str, db_name: str, doc_file_name: str, top_k: int = 5,
+                          query_vector: Optional[np.ndarray] = None, search_params: Optional[Dict[str, Any]] = None) -> str:
     """
     Process document file for the given query and return the result as a JSON string.
 
     :param query: Query string.
     :param db_name: Name of the database.
-    :param doc_file_name: Name of the document file in vector database.
+    :param doc_file_name: Name of the document file in vector database, several names separated by commas, or ``*``.
+    :param top_k: Number of top results to return.
+    :param query_vector: Embedding of the query, if already computed.
+    :param search_params: Index search params overriding the collection defaults.
     :return: JSON string result from document search.
     """
+    query_vectors = None if query_vector is None else query_vector.reshape(1, -1)
+    search_results = process_document_queries([query], db_name, doc_file_name, top_k, query_vectors=query_vectors,
+                                              search_params=search_params)[0]
+    return json.dumps(search_results, ensure_ascii=False)
+
+
+def embed_queries(queries: List[str]) -> np.ndarray:
+    """
+    Embed query strings.
+
+    :param queries: Query strings.
+    :return: float32 matrix with one row per query.
+    """
+    try:
+        return embedding_model.embed(queries)[0]
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error embedding query: {e}")
+
+
+def process_document_queries(queries: List[str], db_name: str, doc_file_name: str, top_k: int = 5,
+                             query_vectors: Optional[np.ndarray] = None,
+                             search_params: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Search the document file with several queries at once: all queries are embedded together
+    and sent to the vector database as one matrix. When several collections are given they are
+    searched concurrently and merged into a global top-k. With ``Config.HYBRID_SEARCH`` the vector
+    hits are fused with BM25 keyword hits by reciprocal rank fusion.
+
+    :param queries: Query strings.
+    :param db_name: Name of the database.
+    :param doc_file_name: Name of the document file in vector database, several names separated by commas, or ``*``.
+    :param top_k: Number of top results to return per query.
+    :param query_vectors: Embeddings of the queries, one row per query, if already computed.
+    :param search_params: Index search params overriding the collection defaults.
+    :return: Search results of each query, in the order of ``queries``.
+    """
+    if query_vectors is None:
+        query_vectors = embed_queries(queries)
     try:
-        query_embedding = embedding_model.embed_with_list_of_str([query])
-        query_vector = np.array([query_embedding['output']['embeddings'][0]['embedding']]).astype('float32')
         client = milvus_helper.get_milvus_client(db_name)
 
-        results = milvus_helper.search(client, doc_file_name, query_vector, top_k=5)
-        search_results = []
-        for result in results[0]:
-            search_results.append({
-                "text": result['entity']['text'],
-                "distance": result['distance']
-            })
+        collection_names = parse_collection_names(client, doc_file_name)
+        if not Config.HYBRID_SEARCH:
+            results = milvus_helper.search_collections(client, collection_names, query_vectors, top_k=top_k,
+                                                       search_params=search_params)
+            return [
+                [{"text": result['entity']['text'], "distance": result['distance'], "collection": result['collection'],
+                  **chunk_metadata(result['entity'])}
+                 for result in query_results]
+                for query_results in results
+            ]
 
-        return json.dumps(search_results, ensure_ascii=False)
+        candidates = max(top_k, Config.HYBRID_CANDIDATES)
+        results = milvus_helper.search_collections(client, collection_names, query_vectors, top_k=candidates,
+                                                   search_params=search_params)
+        return [hybrid_rerank(client, db_name, collection_names, query, query_vector, query_results, top_k, candidates)
+                for query, query_vector, query_results in zip(queries, query_vectors, results)]
 
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error processing document file '{doc_file_name}': {e}")
 
+def hybrid_rerank(client, db_name: str, collection_names: List[str], query: str, query_vector: np.ndarray,
+                  vector_hits: List[Dict[str, Any]], top_k: int, candidates: int) -> List[Dict[str, Any]]:
+    """
+    Fuse vector hits of a query with its BM25 hits from the keyword indexes of the same collections.
+
+    Keyword hits missing from the vector hits are scored against the query vector and
+    ranked among the vector hits first, so an exact keyword match is not outranked just
+    because it fell outside the vector candidates.
+
+    :param client: Milvus client of the database.
+    :param query_vector: Embedding of the query.
+    :param vector_hits: Vector search hits, best first.
+    :param top_k: Number of fused results to return.
+    :param candidates: Number of keyword hits to fuse.
+    :return: Fused results with text, vector distance, RRF score and collection.
+    """
+    keyword_hits = []
+    for collection_name in collection_names:
+        keyword_hits.extend((score, collection_name, chunk_key)
+                            for chunk_key, score in keyword_index_store.get(db_name, collection_name).search(query, candidates))
+    keyword_hits = heapq.nlargest(candidates, keyword_hits)
+
+    keyword_keys = [(collection_name, chunk_key) for _, collection_name, chunk_key in keyword_hits]
+
+    # 只出现在关键词结果里的分块，到 Milvus 取回原文和向量，按与查询向量的距离插进向量结果的排名
+    vector_keys = {(hit['collection'], hit['id']) for hit in vector_hits}
+    missing = {}
+    for collection_name, chunk_key in keyword_keys:
+        if (collection_name, chunk_key) not in vector_keys:
+            missing.setdefault(collection_name, []).append(chunk_key)
+    scored_hits = list(vector_hits)
+    if missing:
+        # search_collections 已经保证这些集合的距离度量相同
+        metric_type = milvus_helper.get_metric_type(client, collection_names[0])
+        for collection_name, chunk_keys in missing.items():
+            rows = client.get(collection_name, ids=chunk_keys, output_fields=["text", "vector", *METADATA_FIELDS])
+            if not rows:
+                continue
+            distances = metric_distances([query_vector], [row.pop('vector') for row in rows], metric_type)[0]
+            scored_hits.extend({"id": row['id'], "distance": float(distance), "entity": row, "collection": collection_name}
+                               for row, distance in zip(rows, distances))
+        scored_hits.sort(key=lambda hit: hit['distance'], reverse=metric_type != "L2")
+    vector_by_key = {(hit['collection'], hit['id']): hit for hit in scored_hits}
+    fused = reciprocal_rank_fusion([list(vector_by_key), keyword_keys], weights=[1.0, Config.HYBRID_KEYWORD_WEIGHT])[:top_k]
+
+    results = []
+    for key, score in fused:
+        hit = vector_by_key.get(key)
+        # 关键词索引里有、Milvus 里已经没有的分块（上传中途失败留下的）跳过
+        if hit is None:
+            continue
+        entity = hit['entity']
+        results.append({"text": entity['text'], "distance": hit['distance'], "score": score,
+                        "collection": key[0], **chunk_metadata(entity)})
+    return results
+
+
+def chunk_metadata(entity: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    :return: Source file, page and chunk index of a stored chunk; chunks inserted before these fields existed have none.
+    """
+    return {field: entity[field] for field in ("source", "page", "chunk_index") if field in entity}
+
+
 if __name__ == '__main__':
     import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=5000)
@@ -12,4 +12,94 @@ class Config:
     DEEPSEEK_API= "sk-3dad314c294d41e7b4b07591298dd9ca"
     GLM_MODEL = "glm-4"
     GLM_API = "d36be7fa64e2eb36584501f4f5f0f0fd.iYAkbh6Qc7V6R9Di"
-    DASHSCOPE_MAX_BATCH_SIZE = 25
\ No newline at end of file
+    DASHSCOPE_MAX_BATCH_SIZE = 25
+    # 同时在途的 embedding 批次数，以及失败批次的重试次数和退避基数（秒）
+    EMBEDDING_MAX_CONCURRENCY = 4
+    EMBEDDING_MAX_RETRIES = 3
+    EMBEDDING_RETRY_BACKOFF = 1.0
+    # embedding 向量维度（text-embedding-v2）以及本地 embedding 缓存的位置和容量（条数）
+    EMBEDDING_DIMENSION = 1536
+    EMBEDDING_CACHE_DIR = "embedding_cache"
+    EMBEDDING_CACHE_MAX_ENTRIES = 50000
+    # 是否把 embedding 向量 L2 归一化后再入库和检索（IP 度量下等价于余弦相似度）
+    EMBEDDING_NORMALIZE = False
+    # Milvus 客户端空闲多少秒后关闭
+    MILVUS_CLIENT_IDLE_TIMEOUT = 300
+    # 后台文档入库任务的并发数，以及保留的已结束任务个数
+    INGEST_MAX_WORKERS = 4
+    JOB_HISTORY_SIZE = 1000
+    # PDF OCR 的进程数（1 表示在当前进程内串行识别）和每个分片的页数
+    OCR_MAX_WORKERS = min(4, os.cpu_count() or 1)
+    OCR_PAGES_PER_TASK = 4
+    # 进程内常驻的 OCR 引擎个数上限，以及是否在服务启动时预加载
+    OCR_ENGINE_POOL_SIZE = 2
+    OCR_PRELOAD = True
+    # PDF 的 OCR 模式："smart" 按页面文字层、图片面积和重复图片决定是否 OCR，"full" 识别所有图片
+    OCR_MODE = "smart"
+    # 显示面积小于页面该比例的图片（logo、印章等）不做 OCR
+    OCR_MIN_IMAGE_AREA_RATIO = 0.02
+    # 文字层字符数达到该值的页面视为已有文字层，只识别面积占比不低于 OCR_TEXT_PAGE_MIN_IMAGE_AREA_RATIO 的图片
+    OCR_TEXT_LAYER_MIN_CHARS = 200
+    OCR_TEXT_PAGE_MIN_IMAGE_AREA_RATIO = 0.3
+    # 上传文件落盘时每次读取的字节数，以及文档入库时每批向量化和插入的分块数
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    INGEST_BATCH_SIZE = 256
+    # 写入 Milvus 时每次 upsert 的行数
+    MILVUS_INSERT_BATCH_SIZE = 128
+    # 内存中缓存的已上传表格（预处理后的 DataFrame）总字节数上限，超出时淘汰最久未用的表
+    TABLE_CACHE_MAX_BYTES = 2 * 1024 ** 3
+    # 上传表格时每次读取的行数，以及不同取值数不超过行数该比例的字符串列转为 category
+    TABLE_READ_CHUNK_ROWS = 100000
+    TABLE_CATEGORY_MAX_RATIO = 0.5
+    # locate_* 表格工具每次最多返回的行数，超出时返回匹配总数并可以用 offset 翻页
+    TABLE_LOCATE_MAX_ROWS = 50
+    # /search/batch 单次请求允许的最多查询数
+    SEARCH_BATCH_MAX_QUERIES = 1024
+    # 跨集合搜索时同时查询的集合数
+    MILVUS_SEARCH_MAX_WORKERS = 8
+    # 查询结果缓存：内存 LRU 的条数，磁盘缓存目录（设为 None 时只用内存）及其条数
+    QUERY_CACHE_MAX_ENTRIES = 1000
+    QUERY_CACHE_DIR = "query_cache"
+    QUERY_CACHE_DISK_MAX_ENTRIES = 100000
+    # 语义查询缓存：是否启用，余弦距离不超过该值的查询视为同一问题，缓存条目的有效期（秒），每个数据源的条数和数据源个数上限
+    SEMANTIC_CACHE_ENABLED = True
+    SEMANTIC_CACHE_MAX_DISTANCE = 0.05
+    SEMANTIC_CACHE_TTL = 3600
+    SEMANTIC_CACHE_MAX_ENTRIES_PER_SOURCE = 256
+    SEMANTIC_CACHE_MAX_SOURCES = 100
+    # 各服务商的 OpenAI 兼容接口地址
+    QWEN_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+    GLM_BASE_URL = "https://open.bigmodel.cn/api/paas/v4/"
+    # 生成答案时按顺序尝试的服务商，单次请求超时（秒），每个服务商的并发上限，失败重试次数和退避基数（秒）
+    LLM_PROVIDERS = ["qwen", "deepseek", "glm"]
+    LLM_TIMEOUT = 60
+    LLM_MAX_CONCURRENCY = 8
+    LLM_MAX_RETRIES = 2
+    LLM_RETRY_BACKOFF = 0.5
+    # 当前服务商超过该秒数仍未返回（流式为首个 token）时，同时请求/切换到下一个服务商；None 表示只在出错时切换
+    LLM_HEDGE_AFTER = 10.0
+    # 文档检索同时使用向量和 BM25 关键词检索，各取若干候选后用 RRF 融合
+    HYBRID_SEARCH = True
+    HYBRID_CANDIDATES = 20
+    RRF_K = 60
+    # 融合时关键词结果相对向量结果的权重，调大后精确匹配编号、数字的分块更靠前
+    HYBRID_KEYWORD_WEIGHT = 1.0
+    BM25_K1 = 1.5
+    BM25_B = 0.75
+    # 关键词索引每个集合一个 sqlite 文件，最多同时打开的个数，以及上传时每攒多少个分块写入一次
+    KEYWORD_INDEX_MAX_OPEN = 32
+    KEYWORD_INDEX_BATCH_SIZE = 200
+    # 新建集合的默认向量索引类型和距离度量，以及各索引类型默认的建索引参数和搜索参数（可按集合修改、按查询覆盖）
+    VECTOR_INDEX_TYPE = "AUTOINDEX"
+    VECTOR_METRIC_TYPE = "COSINE"
+    VECTOR_INDEX_PARAMS = {
+        "IVF_FLAT": {"nlist": 1024},
+        "IVF_SQ8": {"nlist": 1024},
+        "HNSW": {"M": 16, "efConstruction": 200},
+    }
+    VECTOR_SEARCH_PARAMS = {
+        "IVF_FLAT": {"nprobe": 16},
+        "IVF_SQ8": {"nprobe": 16},
+        "HNSW": {"ef": 64},
+    }
@@ -2,42 +2,124 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from typing import Generator, List
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Generator, List, Optional, Tuple
 from http import HTTPStatus
+import numpy as np
 from .config import Config
+from .embedding_cache import EmbeddingCache
 import dashscope
 
 class EmbeddingModel:
-    def __init__(self):
+    def __init__(self,
+                 max_concurrency: int = Config.EMBEDDING_MAX_CONCURRENCY,
+                 max_retries: int = Config.EMBEDDING_MAX_RETRIES,
+                 retry_backoff: float = Config.EMBEDDING_RETRY_BACKOFF,
+                 cache: Optional[EmbeddingCache] = None,
+                 normalize: bool = Config.EMBEDDING_NORMALIZE,
+                 dimension: int = Config.EMBEDDING_DIMENSION):
+        self.model_name = dashscope.TextEmbedding.Models.text_embedding_v2
         self.batch_size = Config.DASHSCOPE_MAX_BATCH_SIZE
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.cache = cache
+        self.normalize = normalize
+        self.dimension = dimension
 
     def batched(self, inputs: List) -> Generator[List, None, None]:
         for i in range(0, len(inputs), self.batch_size):
             yield inputs[i:i + self.batch_size]
 
-    def embed_with_list_of_str(self, inputs: List):
-        result = None  # merge the results.
-        batch_counter = 0
-        for batch in self.batched(inputs):
-            resp = dashscope.TextEmbedding.call(
-                model=dashscope.TextEmbedding.Models.text_embedding_v2,
-                api_key=Config.QWEN_API,
-                input=batch)
-            if resp.status_code == HTTPStatus.OK:
-                if result is None:
-                    result = resp
+    def _call_batch(self, batch: List[str]):
+        return dashscope.TextEmbedding.call(
+            model=self.model_name,
+            api_key=Config.QWEN_API,
+            input=batch)
+
+    async def _embed_batch(self, semaphore: asyncio.Semaphore, offset: int, batch: List[str],
+                           out: np.ndarray) -> int:
+        """Embed one batch into rows ``offset:offset + len(batch)`` of ``out``, retrying with exponential backoff and jitter on failure."""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                try:
+                    # dashscope SDK 只提供同步接口，放到线程池里执行，避免阻塞事件循环
+                    resp = await asyncio.to_thread(self._call_batch, batch)
+                except Exception as e:
+                    resp, error = None, e
+            if resp is not None:
+                if resp.status_code == HTTPStatus.OK:
+                    embeddings = resp.output['embeddings']
+                    # 结果不完整时 out 里会留下未初始化的行，并被写进持久缓存，按失败处理
+                    if sorted(emb['text_index'] for emb in embeddings) == list(range(len(batch))):
+                        # 每行直接写进预分配的 float32 矩阵，不保留 Python float 列表
+                        for emb in embeddings:
+                            out[offset + emb['text_index']] = emb['embedding']
+                        return resp.usage['total_tokens']
+                    error = f"expected one embedding per text_index 0..{len(batch) - 1}, got {len(embeddings)} embeddings"
                 else:
-                    for emb in resp.output['embeddings']:
-                        emb['text_index'] += batch_counter
-                        result.output['embeddings'].append(emb)
-                    result.usage['total_tokens'] += resp.usage['total_tokens']
-            else:
-                print(resp)
-            batch_counter += len(batch)
-        return result
+                    error = f"status code: {resp.status_code}, error code: {resp.code}, error message: {resp.message}"
+            if attempt < self.max_retries:
+                delay = self.retry_backoff * (2 ** attempt) * (1 + random.random())
+                print(f"Embedding batch at offset {offset} failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        raise RuntimeError(f"Embedding batch at offset {offset} failed after {self.max_retries + 1} attempts: {error}")
+
+    async def aembed(self, inputs: List[str], normalize: Optional[bool] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+        """
+        Embed texts concurrently, keeping at most ``max_concurrency`` batches in flight.
+        When a cache is configured only cache misses are sent to DashScope.
+
+        :param inputs: Texts to embed.
+        :param normalize: Whether to L2-normalize the rows, defaults to ``self.normalize``.
+        :return: Contiguous float32 matrix with one row per input, and token usage ``{"total_tokens": n}``.
+        """
+        vectors = np.empty((len(inputs), self.dimension), dtype=np.float32)
+        cached = self.cache.get_many(self.model_name, inputs) if self.cache is not None else {}
+        for position, vector in cached.items():
+            vectors[position] = vector
+        # 未命中的文本去重后再请求接口
+        miss_positions = {}
+        for position, text in enumerate(inputs):
+            if position not in cached:
+                miss_positions.setdefault(text, []).append(position)
+        miss_texts = list(miss_positions)
+
+        miss_vectors = np.empty((len(miss_texts), self.dimension), dtype=np.float32)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [
+            self._embed_batch(semaphore, offset, batch, miss_vectors)
+            for offset, batch in zip(range(0, len(miss_texts), self.batch_size), self.batched(miss_texts))
+        ]
+        total_tokens = sum(await asyncio.gather(*tasks))
+
+        if miss_texts:
+            rows = [row for row, text in enumerate(miss_texts) for _ in miss_positions[text]]
+            positions = [position for text in miss_texts for position in miss_positions[text]]
+            vectors[positions] = miss_vectors[rows]
+        if self.cache is not None and miss_texts:
+            self.cache.put_many(self.model_name, miss_texts, miss_vectors)
+
+        if self.normalize if normalize is None else normalize:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors, {"total_tokens": total_tokens}
+
+    def embed(self, inputs: List[str], normalize: Optional[bool] = None) -> Tuple[np.ndarray, Dict[str, int]]:
+        """Synchronous wrapper around :meth:`aembed`."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed(inputs, normalize))
+        # 当前线程已经有运行中的事件循环（例如在 async 接口里被调用），换一个线程运行
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, self.aembed(inputs, normalize)).result()
 
 
 if __name__ == '__main__':
     inputs = ['风急天高猿啸哀', '渚清沙白鸟飞回', '无边落木萧萧下', '不尽长江滚滚来']
     model = EmbeddingModel()
-    print(model.embed_with_list_of_str(inputs)["output"]["embeddings"])
+    vectors, usage = model.embed(inputs)
+    print(vectors.shape, vectors.dtype, usage)
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .config import Config
+
+
+class EmbeddingCache:
+    """
+    Content-addressed on-disk embedding cache.
+
+    Vectors are stored as float32 rows of a memory-mapped file, and a small
+    sqlite index maps ``sha256(model, text)`` to the row ("slot") holding it.
+    When the cache is full the least recently used entry's slot is reused.
+    """
+
+    def __init__(self,
+                 cache_dir: str = Config.EMBEDDING_CACHE_DIR,
+                 dimension: int = Config.EMBEDDING_DIMENSION,
+                 max_entries: int = Config.EMBEDDING_CACHE_MAX_ENTRIES):
+        self.cache_dir = cache_dir
+        self.dimension = dimension
+        self.max_entries = max_entries
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.index_path = os.path.join(self.cache_dir, "index.sqlite")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        expected_size = self.max_entries * self.dimension * np.dtype(np.float32).itemsize
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != expected_size:
+            # 维度或容量配置变了，旧缓存无法复用，直接重建
+            os.remove(self.vectors_path)
+        if not os.path.exists(self.vectors_path) and os.path.exists(self.index_path):
+            # 向量文件不存在时新建的文件全是 0，旧索引的每一行都会命中一个零向量，一起丢掉
+            os.remove(self.index_path)
+        mode = "r+" if os.path.exists(self.vectors_path) else "w+"
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode=mode,
+                                 shape=(self.max_entries, self.dimension))
+
+        self.conn = sqlite3.connect(self.index_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, slot INTEGER UNIQUE NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON entries (last_access)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[int, np.ndarray]:
+        """
+        Look up cached vectors.
+
+        :param model_name: Name of the embedding model.
+        :param texts: Texts to look up.
+        :return: Mapping from position in ``texts`` to a float32 vector, for hits only.
+        """
+        keys = [self.make_key(model_name, text) for text in texts]
+        found = {}
+        with self._lock:
+            slots = {}
+            unique_keys = list(set(keys))
+            # sqlite 对单条语句的参数个数有限制，分批查询
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                slots.update(rows)
+            for position, key in enumerate(keys):
+                if key in slots:
+                    found[position] = np.array(self.vectors[slots[key]])
+            if slots:
+                now = time.time()
+                self.conn.executemany("UPDATE entries SET last_access = ? WHERE key = ?",
+                                      [(now, key) for key in slots])
+                self.conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model_name: str, texts: List[str], vectors: List) -> None:
+        """
+        Store vectors for texts, evicting least recently used entries when full.
+
+        :param model_name: Name of the embedding model.
+        :param texts: Texts that were embedded.
+        :param vectors: Embedding of each text, in the same order.
+        """
+        with self._lock:
+            now = time.time()
+            count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            for text, vector in zip(texts, vectors):
+                vector = np.asarray(vector, dtype=np.float32)
+                if vector.shape != (self.dimension,):
+                    continue
+                key = self.make_key(model_name, text)
+                row = self.conn.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    slot = row[0]
+                elif count < self.max_entries:
+                    # 未满时槽位是连续分配的，下一个空槽就是当前条目数
+                    slot = count
+                    count += 1
+                else:
+                    slot = self.conn.execute(
+                        "SELECT slot FROM entries ORDER BY last_access LIMIT 1"
+                    ).fetchone()[0]
+                    self.conn.execute("DELETE FROM entries WHERE slot = ?", (slot,))
+                    self.evictions += 1
+                self.vectors[slot] = vector
+                self.conn.execute("INSERT OR REPLACE INTO entries (key, slot, last_access) VALUES (?, ?, ?)",
+                                  (key, slot, now))
+            # 先落盘向量，再提交索引，保证索引不会指向未写入的数据
+            self.vectors.flush()
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "entries": entries,
+                "capacity": self.max_entries,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self.vectors.flush()
+            self.conn.close()
@@ -0,0 +1,136 @@
+import argparse
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from .config import Config
+from .vector_db import RESERVED_COLLECTION_PREFIX, metric_distances
+
+# 默认对比的索引设置：每种索引类型一组建索引参数，和若干组搜索参数
+DEFAULT_BENCHMARK_SETTINGS = [
+    {"index_type": "FLAT", "index_params": {}, "search_params": [{}]},
+    {"index_type": "IVF_FLAT", "index_params": {"nlist": 128},
+     "search_params": [{"nprobe": 4}, {"nprobe": 16}, {"nprobe": 64}]},
+    {"index_type": "HNSW", "index_params": {"M": 16, "efConstruction": 200},
+     "search_params": [{"ef": 16}, {"ef": 64}, {"ef": 256}]},
+]
+
+
+def load_vectors(client, collection_name: str, batch_size: int = 1000):
+    """
+    :return: ids and float32 vector matrix of every entity in a collection.
+    """
+    ids = []
+    vectors = []
+    iterator = client.query_iterator(collection_name, batch_size=batch_size, output_fields=["vector"])
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            ids.extend(row["id"] for row in batch)
+            vectors.extend(row["vector"] for row in batch)
+    finally:
+        iterator.close()
+    return np.array(ids), np.array(vectors, dtype=np.float32)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, top_k: int, metric_type: str) -> np.ndarray:
+    """
+    :return: Row indices of the exact ``top_k`` neighbours of each query, by brute force.
+    """
+    distances = metric_distances(queries, vectors, metric_type)
+    scores = -distances if metric_type == "L2" else distances
+    top = np.argpartition(-scores, min(top_k, scores.shape[1] - 1), axis=1)[:, :top_k]
+    return top
+
+
+def benchmark_collection(milvus_helper, client, collection_name: str, settings: Optional[List[Dict[str, Any]]] = None,
+                         top_k: int = 10, num_queries: int = 100, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Measure recall@k against exact search and per-query latency of several index settings on the
+    vectors of a collection. Each index type is built on a temporary copy of the collection, named
+    with ``RESERVED_COLLECTION_PREFIX`` and dropped afterwards; the collection itself is not modified.
+
+    :param milvus_helper: MilvusHelper owning the client.
+    :param client: Milvus client of the database holding the collection.
+    :param collection_name: Name of the collection to benchmark.
+    :param settings: Index settings to compare, see ``DEFAULT_BENCHMARK_SETTINGS``.
+    :param top_k: Number of neighbours per query.
+    :param num_queries: Number of stored vectors sampled as queries.
+    :param seed: Seed of the query sample.
+    :return: One row per (index settings, search params) with recall and latency.
+    :raises ValueError: If the temporary copy already exists, left by another benchmark of the collection.
+    """
+    settings = settings or DEFAULT_BENCHMARK_SETTINGS
+    bench_name = f"{RESERVED_COLLECTION_PREFIX}{collection_name}"
+    if client.has_collection(bench_name):
+        raise ValueError(f"Temporary collection '{bench_name}' already exists; another benchmark of "
+                         f"'{collection_name}' is running or was interrupted")
+    metric_type = milvus_helper.get_metric_type(client, collection_name)
+    ids, vectors = load_vectors(client, collection_name)
+    if not len(ids):
+        return []
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)]
+    truth = [set(ids[row]) for row in exact_top_k(vectors, queries, top_k, metric_type)]
+
+    report = []
+    for setting in settings:
+        try:
+            start = time.perf_counter()
+            milvus_helper.create_collection(client, bench_name, index_type=setting["index_type"], metric_type=metric_type,
+                                            index_params=setting.get("index_params"), search_params={})
+            for i in range(0, len(ids), Config.INGEST_BATCH_SIZE):
+                client.insert(bench_name, [{"id": int(chunk_key), "vector": vector}
+                                           for chunk_key, vector in zip(ids[i:i + Config.INGEST_BATCH_SIZE],
+                                                                        vectors[i:i + Config.INGEST_BATCH_SIZE])])
+            client.flush(bench_name)
+            client.load_collection(bench_name)
+            build_time = time.perf_counter() - start
+
+            for search_params in setting.get("search_params") or [{}]:
+                latencies = []
+                hits = 0
+                # 集合不足 top_k 行时精确结果也不足 top_k 个，按实际个数算召回率
+                expected_total = 0
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    results = client.search(bench_name, data=[query], limit=top_k, search_params={"params": search_params})
+                    latencies.append(time.perf_counter() - start)
+                    hits += len(expected & {hit["id"] for hit in results[0]})
+                    expected_total += len(expected)
+                report.append({
+                    "index_type": setting["index_type"],
+                    "index_params": setting.get("index_params") or {},
+                    "search_params": search_params,
+                    f"recall@{top_k}": hits / expected_total,
+                    "latency_avg_ms": float(np.mean(latencies) * 1000),
+                    "latency_p95_ms": float(np.percentile(latencies, 95) * 1000),
+                    "build_time_s": build_time,
+                })
+        finally:
+            milvus_helper.drop_collection(client, bench_name)
+    return report
+
+
+if __name__ == "__main__":
+    from .vector_db import MilvusHelper
+
+    parser = argparse.ArgumentParser(description="Report recall@k vs latency of vector index settings on a collection. "
+                                                 "Milvus Lite files can only be opened by one process, stop the API server first.")
+    parser.add_argument("--db-name", required=True)
+    parser.add_argument("--collection-name", required=True)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--num-queries", type=int, default=100)
+    args = parser.parse_args()
+
+    helper = MilvusHelper()
+    with helper.writer(args.db_name) as milvus_client:
+        rows = benchmark_collection(helper, milvus_client, args.collection_name, top_k=args.top_k, num_queries=args.num_queries)
+    for row in rows:
+        print(f"{row['index_type']:<10} {str(row['index_params']):<34} {str(row['search_params']):<16} "
+              f"recall@{args.top_k}={row[f'recall@{args.top_k}']:.3f} "
+              f"avg={row['latency_avg_ms']:.2f}ms p95={row['latency_p95_ms']:.2f}ms build={row['build_time_s']:.2f}s")
+    helper.close_all()
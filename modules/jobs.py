@@ -0,0 +1,130 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from .config import Config
+
+
+class Job:
+    """State of one background job, updated by the worker as it moves through stages."""
+
+    def __init__(self, job_id: str, file_name: str):
+        self.job_id = job_id
+        self.file_name = file_name
+        self.status = "queued"
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_times = {}
+        self.counters = {}
+        self._stage_started = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str, total: Optional[int] = None) -> None:
+        with self._lock:
+            now = time.time()
+            if self.stage is not None:
+                self.stage_times[self.stage] = now - self._stage_started
+            self.stage = stage
+            self.done = 0
+            self.total = total
+            self._stage_started = now
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        with self._lock:
+            self.done = done
+            if total is not None:
+                self.total = total
+
+    def advance(self, n: int = 1) -> None:
+        with self._lock:
+            self.done += n
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _finish(self, status: str) -> None:
+        with self._lock:
+            now = time.time()
+            if self.stage is not None:
+                self.stage_times[self.stage] = now - self._stage_started
+            self.status = status
+            self.finished_at = now
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "file_name": self.file_name,
+                "status": self.status,
+                "stage": self.stage,
+                "progress": {"done": self.done, "total": self.total},
+                "stage_times": dict(self.stage_times),
+                "counters": dict(self.counters),
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobManager:
+    """Run jobs on a thread pool and keep their state for progress queries."""
+
+    def __init__(self, max_workers: int = Config.INGEST_MAX_WORKERS,
+                 history_size: int = Config.JOB_HISTORY_SIZE):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingest")
+        self.history_size = history_size
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, file_name: str, fn: Callable[..., Any], *args, **kwargs) -> Job:
+        """
+        Queue ``fn(job, *args, **kwargs)`` and return its job immediately.
+
+        :param file_name: Name of the file the job processes.
+        :param fn: Callable doing the work; its return value becomes the job result.
+        :return: The queued job.
+        """
+        job = Job(uuid.uuid4().hex, file_name)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._trim()
+        self.executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable[..., Any], args, kwargs) -> None:
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job._finish("succeeded")
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job._finish("failed")
+
+    def _trim(self) -> None:
+        # 只保留最近的若干个已结束任务
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(len(self._jobs) - self.history_size, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        # 还在排队的任务直接取消
+        self.executor.shutdown(wait=wait, cancel_futures=True)
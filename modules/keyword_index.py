@@ -0,0 +1,228 @@
+import heapq
+import math
+import os
+import re
+import shutil
+import sqlite3
+import threading
+from collections import Counter, OrderedDict, defaultdict
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+from .config import Config
+
+# 连续的汉字切成相邻两字的二元组；字母数字串（产品编号、KPI 名称、数字）整体保留，并拆出其中各段
+TOKEN_PATTERN = re.compile(r"[\u4e00-\u9fff]+|[a-z0-9]+(?:[\-_.][a-z0-9]+)*")
+WORD_SEPARATOR = re.compile(r"[\-_.]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        word = match.group()
+        if "\u4e00" <= word[0] <= "\u9fff":
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+            parts = WORD_SEPARATOR.split(word)
+            if len(parts) > 1:
+                tokens.extend(parts)
+    return tokens
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index over the chunks of one collection, stored in a sqlite file.
+
+    ``postings`` holds the term frequency of each (term, chunk) pair and ``docs``
+    the length of each chunk; nothing else is kept in memory. Chunks are added
+    and removed individually, so a re-upload only writes the chunks that changed.
+    Added chunks are buffered and written in batches of ``batch_size``; call
+    :meth:`flush` after the last one.
+    """
+
+    def __init__(self, path: str, k1: float = Config.BM25_K1, b: float = Config.BM25_B,
+                 batch_size: int = Config.KEYWORD_INDEX_BATCH_SIZE):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.batch_size = batch_size
+        # 还没写入的分块：(词, 分块 id, 词频) 和 (分块 id, 长度)
+        self._pending_postings = []
+        self._pending_docs = {}
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL 模式下上传写入时检索照常读取
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, chunk_id INTEGER NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_chunk ON postings (chunk_id)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS docs (chunk_id INTEGER PRIMARY KEY, length INTEGER NOT NULL)")
+        self.conn.commit()
+
+    def _contains(self, chunk_id: int) -> bool:
+        return (chunk_id in self._pending_docs
+                or self.conn.execute("SELECT 1 FROM docs WHERE chunk_id = ?", (chunk_id,)).fetchone() is not None)
+
+    def _flush(self) -> None:
+        if not self._pending_docs:
+            return
+        # 按词排序后插入，写入集中在 B 树的相邻页上
+        self._pending_postings.sort()
+        self.conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", self._pending_postings)
+        self.conn.executemany("INSERT INTO docs (chunk_id, length) VALUES (?, ?)", self._pending_docs.items())
+        self.conn.commit()
+        self._pending_postings = []
+        self._pending_docs = {}
+
+    def __contains__(self, chunk_id: int) -> bool:
+        with self._lock:
+            return self._contains(chunk_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._flush()
+            return self.conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add(self, chunk_id: int, text: str) -> None:
+        term_counts = Counter(tokenize(text))
+        with self._lock:
+            if self._contains(chunk_id):
+                return
+            self._pending_postings.extend((term, chunk_id, count) for term, count in term_counts.items())
+            self._pending_docs[chunk_id] = sum(term_counts.values())
+            if len(self._pending_docs) >= self.batch_size:
+                self._flush()
+
+    def remove(self, chunk_ids: Iterable[int]) -> None:
+        chunk_ids = list(chunk_ids)
+        with self._lock:
+            self._flush()
+            # sqlite 对单条语句的参数个数有限制，分批删除
+            for i in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                self.conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", batch)
+                self.conn.execute(f"DELETE FROM docs WHERE chunk_id IN ({placeholders})", batch)
+            self.conn.commit()
+
+    def ids(self) -> List[int]:
+        with self._lock:
+            self._flush()
+            return [chunk_id for (chunk_id,) in self.conn.execute("SELECT chunk_id FROM docs")]
+
+    def flush(self) -> None:
+        """Write the chunks added since the last write."""
+        with self._lock:
+            self._flush()
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """
+        :return: Up to ``limit`` ``(chunk_id, bm25_score)`` pairs, best first.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        with self._lock:
+            self._flush()
+            n, total_length = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM docs").fetchone()
+            if not n:
+                return []
+            avgdl = total_length / n
+            scores = defaultdict(float)
+            for term in terms:
+                postings = self.conn.execute(
+                    "SELECT p.chunk_id, p.tf, d.length FROM postings p JOIN docs d ON d.chunk_id = p.chunk_id "
+                    "WHERE p.term = ?", (term,)
+                ).fetchall()
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf, length in postings:
+                    norm = self.k1 * (1 - self.b + self.b * length / avgdl)
+                    scores[chunk_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self.conn.close()
+
+
+class KeywordIndexStore:
+    """
+    Keyword indexes of all collections, one sqlite file per collection.
+
+    Indexes are opened on first use; when more than ``max_open`` are open the least
+    recently used one is dropped from the store. An index still held by a caller
+    stays usable and its connection is closed once it is no longer referenced.
+    """
+
+    def __init__(self, folder: str, max_open: int = Config.KEYWORD_INDEX_MAX_OPEN):
+        self.folder = folder
+        self.max_open = max_open
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, db_name: str, collection_name: str) -> str:
+        return os.path.join(self.folder, db_name, f"{collection_name}.sqlite")
+
+    def exists(self, db_name: str, collection_name: str) -> bool:
+        return os.path.exists(self._path(db_name, collection_name))
+
+    def get(self, db_name: str, collection_name: str) -> KeywordIndex:
+        """
+        :return: Index of the collection, empty if it was never built.
+        """
+        key = (db_name, collection_name)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                path = self._path(db_name, collection_name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                index = KeywordIndex(path)
+                self._indexes[key] = index
+                while len(self._indexes) > self.max_open:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(key)
+            return index
+
+    def delete(self, db_name: str, collection_name: str) -> None:
+        with self._lock:
+            index = self._indexes.pop((db_name, collection_name), None)
+        if index is not None:
+            index.close()
+        path = self._path(db_name, collection_name)
+        for file_path in (path, f"{path}-wal", f"{path}-shm"):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def clear(self) -> None:
+        with self._lock:
+            indexes = list(self._indexes.values())
+            self._indexes.clear()
+        for index in indexes:
+            index.close()
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Hashable]], k: int = Config.RRF_K,
+                           weights: List[float] = None) -> List[Tuple[Hashable, float]]:
+    """
+    Fuse several rankings of the same items: each item scores ``sum(weight / (k + rank))`` over the lists it appears in.
+
+    :return: ``(item, score)`` pairs, best first.
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores = defaultdict(float)
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, item in enumerate(ranked, start=1):
+            scores[item] += weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
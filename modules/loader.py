@@ -1,9 +1,13 @@
-from typing import List, Optional
+from typing import Callable, Iterator, List, Optional
 from langchain.docstore.document import Document
 from langchain.document_loaders.unstructured import UnstructuredFileLoader
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
 import docx
 import subprocess
+from .config import Config
+from .ocr import ocr_engine_manager
 from .splitter import ChineseRecursiveTextSplitter
 import re
 
@@ -29,29 +33,31 @@ class DocxDocLoader(UnstructuredFileLoader):
 
     def load(self) -> List[Document]:
         """Load data into document objects."""
-        docs = []
+        return list(self.lazy_load())
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield chunk documents as paragraphs are read and split."""
         try:
-            text = self.docx2text(self.file_path)
+            texts = self.iter_paragraphs(self.file_path)
             if self.dataclean:
-                text = self.clean_data(text)
+                # clean_data 会把连续空白（包括换行）压成一个空格，段落之间同样用空格连接
+                texts = (text + " " for text in map(self.clean_data, texts) if text)
             metadata = {"source": self.file_path}
-            chunks = self.text_splitter.split_text(text)
-            for chunk in chunks:
+            for chunk in self.text_splitter.split_text_stream(texts):
                 if self.add_file_name:
                     chunk = f"[{self.file_name}] : {chunk}"
-                doc = Document(page_content=chunk, metadata=metadata)
-                docs.append(doc)
-            return docs
+                yield Document(page_content=chunk, metadata=metadata)
         except Exception as e:
             raise RuntimeError(f"Error loading {self.file_path}") from e
 
-    def docx2text(self, filepath):
+    def iter_paragraphs(self, filepath) -> Iterator[str]:
         doc = docx.Document(filepath)
-        fullText = []
         for para in doc.paragraphs:
             if not para._p.xpath('.//w:drawing'):  # 检查段落中是否包含图片
-                fullText.append(para.text)
-        return "\n".join(fullText)
+                yield para.text + "\n"
+
+    def docx2text(self, filepath):
+        return "".join(self.iter_paragraphs(filepath))[:-1]
 
     def doc2text(self, filepath):
         output = subprocess.check_output(['antiword', filepath])
@@ -76,10 +82,8 @@ class DocxDocLoader(UnstructuredFileLoader):
 class RapidOCRLoader(UnstructuredFileLoader):
     def _get_elements(self) -> List:
         def img2text(filepath):
-            from rapidocr_onnxruntime import RapidOCR
             resp = ""
-            ocr = RapidOCR()
-            result, _ = ocr(filepath)
+            result = ocr_engine_manager.recognize(filepath)
             if result:
                 ocr_result = [line[1] for line in result]
                 resp += "\n".join(ocr_result)
@@ -99,52 +103,192 @@ class RapidOCRPDFLoader(UnstructuredFileLoader):
         chunk_overlap: int = 0,
         unstructured_kwargs: Optional[dict] = None,
         dataclean: bool = True,
-        add_file_name: bool = True
+        add_file_name: bool = True,
+        progress_callback: Optional[Callable[[int, int], None]] = None,
+        max_workers: int = Config.OCR_MAX_WORKERS,
+        ocr_mode: str = Config.OCR_MODE,
     ):
         super().__init__(
             file_path=file_path,
             unstructured_kwargs=unstructured_kwargs,
         )
         self.text_splitter = ChineseRecursiveTextSplitter(keep_separator=True, is_separator_regex=True, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        # 每处理完一页调用 progress_callback(已处理页数, 总页数)
+        self.progress_callback = progress_callback
+        # 同时占用的 OCR 进程数，大于 1 时按页分片到共享的进程池并行识别，不超过进程池的大小
+        self.max_workers = max(1, min(max_workers, Config.OCR_MAX_WORKERS))
+        # "full" 对每张图片都做 OCR；"smart" 跳过小图、重复图片和已有文字层页面上的配图
+        self.ocr_mode = ocr_mode
+        self.ocr_stats = None
 
     def load(self) -> List[Document]:
         """Load data into document objects."""
-        docs = []
+        return list(self.lazy_load())
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield chunk documents as pages are extracted and split, with the page each chunk starts on."""
         try:
-            text = self.pdf2text(self.file_path)
-            metadata = {"source": self.file_path}
-            chunks = self.text_splitter.split_text(text)
-            for chunk in chunks:
-                doc = Document(page_content=chunk, metadata=metadata)
-                docs.append(doc)
+            for chunk, page_index in self.text_splitter.split_text_stream_with_index(self.iter_page_texts(self.file_path)):
+                yield Document(page_content=chunk, metadata={"source": self.file_path, "page": page_index + 1})
         except Exception as e:
             raise RuntimeError(f"Error loading {self.file_path}") from e
-        return docs
 
     def pdf2text(self, filepath):
+        return "".join(self.iter_page_texts(filepath))
+
+    def iter_page_texts(self, filepath) -> Iterator[str]:
+        """Yield the text of each page in page order."""
         import fitz  # pyMuPDF里面的fitz包，不要与pip install fitz混淆
-        from rapidocr_onnxruntime import RapidOCR
-        import numpy as np
-        ocr = RapidOCR()
-        doc = fitz.open(filepath)
-        resp = ""
-        b_unit = tqdm(total=doc.page_count, desc="RapidOCRPDFLoader context page index: 0")
-        for i, page in enumerate(doc):
-            # 更新描述
-            b_unit.set_description("RapidOCRPDFLoader context page index: {}".format(i))
-            # 立即显示进度条更新结果
-            b_unit.refresh()
+        with fitz.open(filepath) as doc:
+            page_count = doc.page_count
+        pages_per_task = Config.OCR_PAGES_PER_TASK
+        self.ocr_stats = dict.fromkeys(OCR_STAT_KEYS, 0)
+        if self.max_workers <= 1 or page_count <= pages_per_task:
+            yield from _iter_pdf_page_texts(filepath, range(page_count), self.ocr_mode, self.ocr_stats, self._report_page)
+        else:
+            # 按连续页码分片提交到所有任务共享的常驻进程池，每个任务最多同时挂起 max_workers 个分片，
+            # 按页码顺序取回结果，内存占用不随页数增长
+            pool = get_ocr_process_pool()
+            starts = iter(range(0, page_count, pages_per_task))
+            pending = {}
+            # 要识别哪些图片在主进程里按页码顺序决定，重复图片在整个文档里只识别一次，而不是每个分片一次
+            seen_digests = set()
+
+            with fitz.open(filepath) as doc:
+                def submit_next():
+                    start = next(starts, None)
+                    if start is not None:
+                        end = min(start + pages_per_task, page_count)
+                        ocr_plan = _plan_pdf_ocr(doc, range(start, end), self.ocr_mode, seen_digests, self.ocr_stats)
+                        pending[start] = pool.submit(_ocr_pdf_pages, filepath, start, end, self.ocr_mode, ocr_plan)
+
+                for _ in range(self.max_workers):
+                    submit_next()
+                for start in range(0, page_count, pages_per_task):
+                    shard, shard_stats = pending.pop(start).result()
+                    submit_next()
+                    for key, value in shard_stats.items():
+                        self.ocr_stats[key] += value
+                    self._report_page(start + len(shard), page_count)
+                    yield from shard
+        skipped = sum(value for key, value in self.ocr_stats.items() if key.startswith("skipped_"))
+        print(f"{filepath}: OCR ran on {self.ocr_stats['ocr_calls']} images, skipped {skipped} {self.ocr_stats}")
+
+    def _report_page(self, done, total):
+        if self.progress_callback is not None:
+            self.progress_callback(done, total)
+
+
+OCR_STAT_KEYS = ["ocr_calls", "skipped_small", "skipped_duplicate", "skipped_text_layer"]
+
+
+def _images_to_ocr(page, text, ocr_mode, seen_digests, stats):
+    """Pick the xrefs of the images on a page that need OCR."""
+    if ocr_mode == "full":
+        return [img[0] for img in page.get_images()]
+
+    import fitz
+    page_area = page.rect.width * page.rect.height
+    has_text_layer = len(text.strip()) >= Config.OCR_TEXT_LAYER_MIN_CHARS
+    xrefs = []
+    for info in page.get_image_info(hashes=True, xrefs=True):
+        if not info["xref"]:
+            # 内联图片没有 xref，和 full 模式一样不处理
+            continue
+        rect = fitz.Rect(info["bbox"]) & page.rect
+        area_ratio = rect.width * rect.height / page_area if page_area and not rect.is_empty else 0
+        if area_ratio < Config.OCR_MIN_IMAGE_AREA_RATIO:
+            # logo、印章、图标之类的小图
+            stats["skipped_small"] += 1
+        elif info["digest"] in seen_digests:
+            # 页眉页脚等重复出现的图片只识别一次
+            stats["skipped_duplicate"] += 1
+        elif has_text_layer and area_ratio < Config.OCR_TEXT_PAGE_MIN_IMAGE_AREA_RATIO:
+            # 页面已有文字层，只识别占页面比例较大的图片（例如扫描插页）
+            stats["skipped_text_layer"] += 1
+        else:
+            seen_digests.add(info["digest"])
+            xrefs.append(info["xref"])
+    return xrefs
+
+
+def _plan_pdf_ocr(doc, page_numbers, ocr_mode, seen_digests, stats):
+    """
+    Pick the images to OCR on each of the given pages of an open document.
+
+    :param seen_digests: Digests of the images already picked on earlier pages, updated in place.
+    :return: Mapping from page number to image xrefs, or None in ``"full"`` mode where every image is OCR'd.
+    """
+    if ocr_mode == "full":
+        return None
+    return {page_number: _images_to_ocr(doc[page_number], doc[page_number].get_text(""), ocr_mode, seen_digests, stats)
+            for page_number in page_numbers}
+
+
+def _iter_pdf_page_texts(filepath, page_numbers, ocr_mode, stats, progress_callback=None, ocr_plan=None):
+    """
+    Extract the text layer and OCR the embedded images of the given pages, yielding one string per page.
+    Counters of OCR calls and skipped images are accumulated into ``stats``.
+
+    :param ocr_plan: Image xrefs to OCR per page, see :func:`_plan_pdf_ocr`. Picked page by page when None.
+    """
+    import fitz
+    import numpy as np
+    seen_digests = set()
+    with fitz.open(filepath) as doc:
+        for i, page_number in enumerate(page_numbers):
+            page = doc[page_number]
             # TODO: 依据文本与图片顺序调整处理方式
             text = page.get_text("")
-            resp += text + "\n"
-            img_list = page.get_images()
-            for img in img_list:
-                pix = fitz.Pixmap(doc, img[0])
+            parts = [text, "\n"]
+            if ocr_plan is not None:
+                xrefs = ocr_plan[page_number]
+            else:
+                xrefs = _images_to_ocr(page, text, ocr_mode, seen_digests, stats)
+            for xref in xrefs:
+                pix = fitz.Pixmap(doc, xref)
                 img_array = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, -1)
-                result, _ = ocr(img_array)
+                result = ocr_engine_manager.recognize(img_array)
+                stats["ocr_calls"] += 1
                 if result:
                     ocr_result = [line[1] for line in result]
-                    resp += "\n".join(ocr_result)
+                    parts.append("\n".join(ocr_result))
             # 更新进度
-            b_unit.update(1)
-        return resp
\ No newline at end of file
+            if progress_callback is not None:
+                progress_callback(i + 1, len(page_numbers))
+            yield "".join(parts)
+
+
+def _init_ocr_worker():
+    # 子进程启动时预热本进程的 OCR 引擎，之后的分片都复用它
+    ocr_engine_manager.warmup()
+
+
+def _ocr_pdf_pages(filepath, start, end, ocr_mode, ocr_plan=None):
+    stats = dict.fromkeys(OCR_STAT_KEYS, 0)
+    page_texts = list(_iter_pdf_page_texts(filepath, range(start, end), ocr_mode, stats, ocr_plan=ocr_plan))
+    return page_texts, stats
+
+
+_ocr_process_pool = None
+_ocr_process_pool_lock = threading.Lock()
+
+
+def get_ocr_process_pool() -> ProcessPoolExecutor:
+    """Return the OCR process pool shared by all jobs, with ``Config.OCR_MAX_WORKERS`` workers, creating it on first use."""
+    global _ocr_process_pool
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is None:
+            # 用 spawn 而不是 fork，避免在多线程的服务进程里 fork 出状态不一致的子进程
+            _ocr_process_pool = ProcessPoolExecutor(max_workers=Config.OCR_MAX_WORKERS,
+                                                    mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=_init_ocr_worker)
+        return _ocr_process_pool
+
+
+def shutdown_ocr_process_pool():
+    global _ocr_process_pool
+    with _ocr_process_pool_lock:
+        if _ocr_process_pool is not None:
+            _ocr_process_pool.shutdown(wait=False, cancel_futures=True)
+            _ocr_process_pool = None
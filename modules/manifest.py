@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_id(chunk_hash: str, occurrence: int = 0) -> int:
+    """
+    Stable int64 primary key of a chunk, derived from its content.
+
+    ``occurrence`` tells apart identical chunks repeated in one document.
+    """
+    digest = hashlib.sha256(f"{chunk_hash}:{occurrence}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") & (2 ** 63 - 1)
+
+
+class ManifestStore:
+    """
+    Per-document manifests recording the id, content hash and position of every chunk in a collection,
+    so re-uploads only embed and insert the chunks that changed, and only rewrite the metadata of
+    unchanged chunks that moved.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def _path(self, db_name: str, collection_name: str) -> str:
+        return os.path.join(self.folder, db_name, f"{collection_name}.json")
+
+    def lock(self, db_name: str, collection_name: str) -> threading.Lock:
+        """Lock held while a document is (re)ingested, so concurrent uploads of it do not interleave."""
+        with self._locks_lock:
+            return self._locks.setdefault((db_name, collection_name), threading.Lock())
+
+    def exists(self, db_name: str, collection_name: str) -> bool:
+        return os.path.exists(self._path(db_name, collection_name))
+
+    def load(self, db_name: str, collection_name: str) -> Dict[int, str]:
+        """
+        :return: Mapping from chunk id to content hash, empty if the document was never ingested.
+        """
+        path = self._path(db_name, collection_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return {int(chunk_id): chunk_hash for chunk_id, chunk_hash in manifest["chunks"].items()}
+
+    def load_positions(self, db_name: str, collection_name: str) -> Dict[int, List]:
+        """
+        :return: Mapping from chunk id to ``[source, page, chunk_index]`` as stored in the collection,
+            empty if the document was never ingested or its manifest predates positions.
+        """
+        path = self._path(db_name, collection_name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        return {int(chunk_id): position for chunk_id, position in manifest.get("positions", {}).items()}
+
+    def save(self, db_name: str, collection_name: str, chunks: Dict[int, str],
+             positions: Optional[Dict[int, List]] = None) -> None:
+        path = self._path(db_name, collection_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免中途失败留下半个 manifest
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"chunks": {str(chunk_id): chunk_hash for chunk_id, chunk_hash in chunks.items()},
+                       "positions": {str(chunk_id): position for chunk_id, position in (positions or {}).items()}}, f)
+        os.replace(tmp_path, path)
+
+    def delete(self, db_name: str, collection_name: str) -> None:
+        path = self._path(db_name, collection_name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def clear(self) -> None:
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
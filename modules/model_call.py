@@ -1,67 +1,252 @@
 # qwen_call.py
-from dashscope import Generation
 from .config import Config
 import random
-from http import HTTPStatus
+import asyncio
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
-from openai import OpenAI
+import httpx
+import openai
+from openai import AsyncOpenAI
 
-from zhipuai import ZhipuAI
+# OpenAI 兼容接口的各家服务商：名称 -> (base_url, api_key, 模型, 额外的请求参数)
+LLM_PROVIDER_SETTINGS = {
+    "qwen": (Config.QWEN_BASE_URL, Config.QWEN_API, Config.QWEN_CHAT_MODEL, {}),
+    "deepseek": (Config.DEEPSEEK_BASE_URL, Config.DEEPSEEK_API, Config.DEEPSEEK_MODEL,
+                 {"max_tokens": 4096, "temperature": 0.7}),
+    "glm": (Config.GLM_BASE_URL, Config.GLM_API, Config.GLM_MODEL, {}),
+}
 
-class QwenCall():
-    def __init__(self):
-        pass
-    
-    def get_response(self, prompt):
-        messages = [{'role': 'system', 'content': '你是一个专业的人工智能助手'},
-                    {"role": "user", "content": prompt}]
+# 超时、连接失败、限流和服务端错误可以重试，其余错误（鉴权、参数）直接换下一家
+RETRYABLE_ERRORS = (openai.APITimeoutError, openai.APIConnectionError, openai.RateLimitError,
+                    openai.InternalServerError, asyncio.TimeoutError)
 
-        response = Generation.call(
-            model=Config.QWEN_CHAT_MODEL,
-            messages=messages,
-            api_key=Config.QWEN_API,
-            result_format='message'
-        )
 
-        if response.status_code == HTTPStatus.OK:
-            return response.output.choices[0].message['content']
-        else:
-            print('Request id: %s, Status code: %s, error code: %s, error message: %s' % (
-                response.request_id, response.status_code,
-                response.code, response.message
-            ))
-            return None
-        
-
-class DeepseekCall():
-    def __init__(self) -> None:
-        self.client = OpenAI(api_key=Config.DEEPSEEK_API, base_url="https://api.deepseek.com")
-    
-    def get_response(self, prompt):
-        response = self.client.chat.completions.create(
-            model=Config.DEEPSEEK_MODEL,
-            messages=[
-                {"role": "system", "content": "你是一个专业的人工智能助手"},
-                {"role": "user", "content": prompt},
-        ],
-            max_tokens=4096,
-            temperature=0.7,
-            stream=False
+class LLMProvider():
+    """One OpenAI-compatible endpoint with its own connection pool, concurrency limit and metrics."""
+
+    def __init__(self, name: str, base_url: str, api_key: str, model: str, params: Optional[Dict[str, Any]] = None,
+                 max_concurrency: int = Config.LLM_MAX_CONCURRENCY, timeout: float = Config.LLM_TIMEOUT):
+        self.name = name
+        self.model = model
+        self.params = params or {}
+        self.timeout = timeout
+        # 连接池大小和并发上限一致，keep-alive 连接在请求之间复用
+        self.client = AsyncOpenAI(
+            api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)),
         )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.metrics = {"requests": 0, "successes": 0, "failures": 0, "retries": 0, "hedges": 0, "failovers": 0,
+                        "prompt_tokens": 0, "completion_tokens": 0}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.first_token_total = 0.0
+        self.first_token_count = 0
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.metrics[name] += n
+
+    def record_success(self, latency: float, usage: Any = None, first_token: Optional[float] = None) -> None:
+        with self._lock:
+            self.metrics["successes"] += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if first_token is not None:
+                self.first_token_total += first_token
+                self.first_token_count += 1
+            if usage is not None:
+                self.metrics["prompt_tokens"] += usage.prompt_tokens or 0
+                self.metrics["completion_tokens"] += usage.completion_tokens or 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            successes = self.metrics["successes"]
+            return {
+                "model": self.model,
+                **self.metrics,
+                "latency_avg": self.latency_total / successes if successes else None,
+                "latency_max": self.latency_max,
+                "first_token_avg": self.first_token_total / self.first_token_count if self.first_token_count else None,
+            }
+
+
+class AsyncLLMClient():
+    """
+    Async chat client over several OpenAI-compatible providers.
+
+    Providers are tried in ``Config.LLM_PROVIDERS`` order. Each request is retried
+    with jittered exponential backoff on transient errors and fails over to the next
+    provider when retries are exhausted. When the current provider has not answered
+    within ``hedge_after`` seconds, the same request is also sent to the next provider
+    and whichever answers first wins.
+    """
+
+    def __init__(self, provider_names: List[str] = Config.LLM_PROVIDERS,
+                 max_retries: int = Config.LLM_MAX_RETRIES,
+                 retry_backoff: float = Config.LLM_RETRY_BACKOFF,
+                 hedge_after: Optional[float] = Config.LLM_HEDGE_AFTER):
+        self.providers = [LLMProvider(name, *LLM_PROVIDER_SETTINGS[name]) for name in provider_names]
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.hedge_after = hedge_after
+
+    @staticmethod
+    def _messages(prompt: str) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": "你是一个专业的人工智能助手"},
+                {"role": "user", "content": prompt}]
+
+    async def _backoff(self, provider: LLMProvider, attempt: int, error: Exception) -> None:
+        provider.count("retries")
+        # 指数退避加随机抖动，避免多个请求同时重试
+        delay = self.retry_backoff * (2 ** attempt) * (0.5 + random.random())
+        print(f"{provider.name} request failed ({error!r}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def _complete(self, provider: LLMProvider, messages: List[Dict[str, str]]) -> str:
+        for attempt in range(self.max_retries + 1):
+            provider.count("requests")
+            start = time.perf_counter()
+            try:
+                async with provider.semaphore:
+                    response = await provider.client.chat.completions.create(
+                        model=provider.model, messages=messages, **provider.params)
+            except RETRYABLE_ERRORS as e:
+                provider.count("failures")
+                if attempt == self.max_retries:
+                    raise
+                await self._backoff(provider, attempt, e)
+                continue
+            except Exception:
+                provider.count("failures")
+                raise
+            provider.record_success(time.perf_counter() - start, response.usage)
+            return response.choices[0].message.content
+
+    async def get_response(self, prompt: str) -> str:
+        """
+        Get the full answer to a prompt.
+
+        :param prompt: User prompt.
+        :return: Answer of the first provider to succeed.
+        :raises RuntimeError: When every provider failed.
+        """
+        messages = self._messages(prompt)
+        pending = {}
+        errors = []
+        next_provider = 0
+
+        def launch():
+            nonlocal next_provider
+            provider = self.providers[next_provider]
+            next_provider += 1
+            pending[asyncio.create_task(self._complete(provider, messages))] = provider
+            return provider
+
+        launch()
+        try:
+            while pending:
+                can_hedge = self.hedge_after is not None and next_provider < len(self.providers)
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_after if can_hedge else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # 超过延迟预算还没有结果，同时请求下一家
+                    launch().count("hedges")
+                    continue
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(f"{provider.name}: {task.exception()!r}")
+                if not pending and next_provider < len(self.providers):
+                    launch().count("failovers")
+            raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _stream(self, provider: LLMProvider, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        for attempt in range(self.max_retries + 1):
+            provider.count("requests")
+            start = time.perf_counter()
+            stream = None
+            error = None
+            async with provider.semaphore:
+                try:
+                    # 流式接口默认不返回用量，要求在最后一个分片里附带
+                    stream = await provider.client.chat.completions.create(
+                        model=provider.model, messages=messages, stream=True,
+                        stream_options={"include_usage": True}, **provider.params)
+                    chunks = stream.__aiter__()
+                    # 首个 token 超过延迟预算就换下一家
+                    first = await asyncio.wait_for(chunks.__anext__(), timeout=self.hedge_after)
+                except StopAsyncIteration:
+                    await stream.close()
+                    provider.record_success(time.perf_counter() - start)
+                    return
+                except Exception as e:
+                    provider.count("failures")
+                    if stream is not None:
+                        await stream.close()
+                    if not isinstance(e, RETRYABLE_ERRORS) or isinstance(e, asyncio.TimeoutError) or attempt == self.max_retries:
+                        raise
+                    error = e
+                else:
+                    first_token = time.perf_counter() - start
+                    usage = None
+                    try:
+                        chunk = first
+                        while True:
+                            if chunk.choices and chunk.choices[0].delta.content:
+                                yield chunk.choices[0].delta.content
+                            usage = getattr(chunk, "usage", None) or usage
+                            try:
+                                chunk = await chunks.__anext__()
+                            except StopAsyncIteration:
+                                break
+                    except Exception:
+                        provider.count("failures")
+                        raise
+                    finally:
+                        await stream.close()
+                    provider.record_success(time.perf_counter() - start, usage, first_token)
+                    return
+            # 退避时不占用并发名额，让其他请求先用
+            await self._backoff(provider, attempt, error)
+
+    async def stream_response(self, prompt: str) -> AsyncIterator[str]:
+        """
+        Stream the answer to a prompt. Fails over to the next provider while no content
+        has been produced yet, including when the first token takes longer than ``hedge_after``.
+
+        :param prompt: User prompt.
+        :return: Async iterator of answer fragments.
+        :raises RuntimeError: When every provider failed before producing content.
+        """
+        messages = self._messages(prompt)
+        errors = []
+        for index, provider in enumerate(self.providers):
+            if index:
+                provider.count("failovers")
+            started = False
+            try:
+                async for content in self._stream(provider, messages):
+                    started = True
+                    yield content
+                return
+            except Exception as e:
+                if started:
+                    raise
+                errors.append(f"{provider.name}: {e!r}")
+        raise RuntimeError(f"All LLM providers failed: {'; '.join(errors)}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {provider.name: provider.stats() for provider in self.providers}
 
-        return response.choices[0].message.content
-    
-
-class GlmCall():
-    def __init__(self) -> None:
-        self.client = ZhipuAI(api_key=Config.GLM_API)
-
-    def get_response(self, prompt):
-        messages=[{"role": "user", "content": prompt}],
-        
-        response = self.client.chat.completions.create(
-                    model=Config.GLM_MODEL,  # 填写需要调用的模型名称
-                    messages=messages,
-                    )
-        
-        return response.choices[0].message.content
+    async def close(self) -> None:
+        for provider in self.providers:
+            await provider.client.close()
@@ -0,0 +1,111 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from .config import Config
+
+
+class OCREngineManager:
+    """
+    Process-wide pool of warm RapidOCR engines.
+
+    Loading RapidOCR reads the ONNX detection, classification and recognition
+    models from disk, so engines are created once and handed out to callers.
+    Each engine is used by one thread at a time; up to ``pool_size`` engines
+    are created on demand so concurrent uploads do not queue behind each other.
+    """
+
+    def __init__(self, pool_size: int = Config.OCR_ENGINE_POOL_SIZE):
+        self.pool_size = pool_size
+        self._engines = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.load_count = 0
+        self.load_time_total = 0.0
+        self.inference_count = 0
+        self.inference_time_total = 0.0
+        self.inference_time_max = 0.0
+
+    def _create_engine(self):
+        from rapidocr_onnxruntime import RapidOCR
+        start = time.perf_counter()
+        engine = RapidOCR()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.load_count += 1
+            self.load_time_total += elapsed
+        print(f"RapidOCR engine loaded in {elapsed:.2f}s")
+        return engine
+
+    def warmup(self, n: int = 1) -> None:
+        """Eagerly load up to ``n`` engines, e.g. at app startup."""
+        while True:
+            with self._lock:
+                if self._created >= min(n, self.pool_size):
+                    return
+                self._created += 1
+            try:
+                self._engines.put(self._create_engine())
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+    @contextmanager
+    def engine(self):
+        """Borrow an engine, creating one if the pool is not full yet, otherwise wait for one."""
+        try:
+            engine = self._engines.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    engine = self._create_engine()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                engine = self._engines.get()
+        try:
+            yield engine
+        finally:
+            self._engines.put(engine)
+
+    def recognize(self, image: Any) -> Optional[List]:
+        """
+        Run OCR on an image.
+
+        :param image: Image file path, bytes or numpy array.
+        :return: RapidOCR result lines ``[box, text, score]``, or None when nothing is recognized.
+        """
+        with self.engine() as engine:
+            start = time.perf_counter()
+            result, _ = engine(image)
+            elapsed = time.perf_counter() - start
+        with self._lock:
+            self.inference_count += 1
+            self.inference_time_total += elapsed
+            self.inference_time_max = max(self.inference_time_max, elapsed)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "engines": self._created,
+                "pool_size": self.pool_size,
+                "load_count": self.load_count,
+                "load_time_avg": self.load_time_total / self.load_count if self.load_count else None,
+                "inference_count": self.inference_count,
+                "inference_time_avg": self.inference_time_total / self.inference_count if self.inference_count else None,
+                "inference_time_max": self.inference_time_max,
+            }
+
+
+# 进程内共享的 OCR 引擎管理器
+ocr_engine_manager = OCREngineManager()
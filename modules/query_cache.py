@@ -0,0 +1,185 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set
+
+from .config import Config
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace and case so trivially different spellings share a cache entry."""
+    return " ".join(query.split()).lower()
+
+
+class TaggedCache:
+    """
+    Base of the answer caches whose entries are tagged with the data sources they were computed from.
+
+    Callers read :attr:`generation` before computing an answer and pass it to
+    ``put``; :meth:`invalidate` and :meth:`clear` bump it, so an answer computed
+    from data that changed meanwhile is never stored. Subclasses implement
+    :meth:`_drop_tags` and :meth:`_drop_all`, which run under :attr:`_lock`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 每次失效都会加一，计算期间发生过失效的结果不再写入缓存
+        self.generation = 0
+        self.invalidations = 0
+
+    def _is_stale(self, generation: Optional[int]) -> bool:
+        return generation is not None and generation != self.generation
+
+    def _drop_tags(self, tags: Set[str]) -> None:
+        raise NotImplementedError
+
+    def _drop_all(self) -> None:
+        raise NotImplementedError
+
+    def invalidate(self, *tags: str) -> None:
+        """Drop every entry computed from any of ``tags``."""
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._drop_tags(set(tags))
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self.invalidations += 1
+            self._drop_all()
+
+
+class QueryCache(TaggedCache):
+    """
+    Tiered cache of /query and /search responses.
+
+    An in-memory LRU sits in front of an optional sqlite backend. Every entry is
+    tagged with the data sources it was computed from (e.g. ``table:sales`` or
+    ``doc:test/contract``) and :meth:`invalidate` drops all entries carrying a tag
+    when that source is re-uploaded or deleted.
+    """
+
+    def __init__(self,
+                 max_entries: int = Config.QUERY_CACHE_MAX_ENTRIES,
+                 cache_dir: Optional[str] = Config.QUERY_CACHE_DIR,
+                 disk_max_entries: int = Config.QUERY_CACHE_DISK_MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self.conn = None
+        if cache_dir:
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            self.conn = sqlite3.connect(os.path.join(cache_dir, "query_cache.sqlite"), check_same_thread=False)
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS tags (key TEXT NOT NULL, tag TEXT NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tags_tag ON tags (tag)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tags_key ON tags (key)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(kind: str, query: str, **params: Any) -> str:
+        payload = json.dumps([kind, normalize_query(query), sorted(params.items())], ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key][0]
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self.conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+                    self.conn.commit()
+                    tags = [tag for (tag,) in self.conn.execute("SELECT tag FROM tags WHERE key = ?", (key,))]
+                    value = json.loads(row[0])
+                    self._put_memory(key, value, tags)
+                    self.disk_hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, tags: Iterable[str], generation: Optional[int] = None) -> None:
+        """
+        Store a response.
+
+        :param key: Key from :meth:`make_key`.
+        :param value: JSON-serializable response.
+        :param tags: Data sources the response was computed from.
+        :param generation: Value of :attr:`generation` read before computing the response;
+            the entry is dropped if an invalidation happened in between.
+        """
+        tags = list(tags)
+        with self._lock:
+            if self._is_stale(generation):
+                return
+            self._put_memory(key, value, tags)
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO entries (key, value, last_access) VALUES (?, ?, ?)",
+                                  (key, json.dumps(value, ensure_ascii=False, default=str), time.time()))
+                self.conn.execute("DELETE FROM tags WHERE key = ?", (key,))
+                self.conn.executemany("INSERT INTO tags (key, tag) VALUES (?, ?)", [(key, tag) for tag in tags])
+                count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                if count > self.disk_max_entries:
+                    stale = "SELECT key FROM entries ORDER BY last_access LIMIT ?"
+                    self.conn.execute(f"DELETE FROM tags WHERE key IN ({stale})", (count - self.disk_max_entries,))
+                    self.conn.execute(f"DELETE FROM entries WHERE key IN ({stale})", (count - self.disk_max_entries,))
+                self.conn.commit()
+
+    def _put_memory(self, key: str, value: Any, tags) -> None:
+        self._memory[key] = (value, set(tags))
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _drop_tags(self, tags: Set[str]) -> None:
+        for key in [key for key, (_, entry_tags) in self._memory.items() if entry_tags & tags]:
+            del self._memory[key]
+        if self.conn is not None:
+            placeholders = ",".join("?" * len(tags))
+            self.conn.execute(
+                f"DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag IN ({placeholders}))", list(tags))
+            self.conn.execute(
+                f"DELETE FROM tags WHERE key IN (SELECT key FROM tags WHERE tag IN ({placeholders}))", list(tags))
+            self.conn.commit()
+
+    def _drop_all(self) -> None:
+        self._memory.clear()
+        if self.conn is not None:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.execute("DELETE FROM tags")
+            self.conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else None,
+                "invalidations": self.invalidations,
+                "memory_entries": len(self._memory),
+                "disk_entries": self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] if self.conn is not None else None,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
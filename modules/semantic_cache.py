@@ -0,0 +1,200 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+import numpy as np
+
+from .config import Config
+from .query_cache import TaggedCache
+
+# 引号括起来的字面量（中英文引号）和数字，语义相近的查询只要这些不同答案就不同
+_QUOTED_LITERAL = re.compile(r'"([^"]*)"|\'([^\']*)\'|“([^”]*)”|‘([^’]*)’|「([^」]*)」|《([^》]*)》')
+_NUMERIC_LITERAL = re.compile(r'\d+(?:[.,]\d+)*')
+
+
+def extract_literals(query: str) -> Tuple[str, ...]:
+    """
+    Extract the quoted strings and numbers of a query, in order of appearance.
+
+    Embeddings barely move when only a number or a quoted name changes
+    ("收入大于3000" vs "收入大于3500"), so a semantic hit also requires these to match exactly.
+    """
+    literals = []
+    for match in _QUOTED_LITERAL.finditer(query):
+        literals.append(next(group for group in match.groups() if group is not None))
+    unquoted = _QUOTED_LITERAL.sub(" ", query)
+    literals.extend(number.replace(",", "") for number in _NUMERIC_LITERAL.findall(unquoted))
+    return tuple(literals)
+
+
+class _SourceIndex:
+    """Fixed-capacity matrix of normalized query embeddings and their answers for one data source."""
+
+    def __init__(self, capacity: int, dimension: int, tags: Iterable[str]):
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.valid = np.zeros(capacity, dtype=bool)
+        self.created = np.zeros(capacity, dtype=np.float64)
+        self.last_access = np.zeros(capacity, dtype=np.float64)
+        self.queries = [None] * capacity
+        self.literals = [None] * capacity
+        self.responses = [None] * capacity
+        self.tags = set(tags)
+
+    def expire(self, now: float, ttl: float) -> int:
+        expired = self.valid & (self.created < now - ttl)
+        for slot in np.flatnonzero(expired):
+            self.queries[slot] = None
+            self.literals[slot] = None
+            self.responses[slot] = None
+        self.valid &= ~expired
+        return int(expired.sum())
+
+    def free_slot(self) -> Tuple[int, bool]:
+        """:return: Slot to write to and whether a live entry is evicted to make room."""
+        free = np.flatnonzero(~self.valid)
+        if len(free):
+            return int(free[0]), False
+        return int(np.argmin(self.last_access)), True
+
+    def similarities(self, vector: np.ndarray, literals: Tuple[str, ...]) -> np.ndarray:
+        """Cosine similarity to every live entry with the same literals, -inf for the others."""
+        # 向量都已归一化，内积即余弦相似度
+        matching = self.valid & np.array([entry == literals for entry in self.literals], dtype=bool)
+        return np.where(matching, self.vectors @ vector, -np.inf)
+
+
+class SemanticQueryCache(TaggedCache):
+    """
+    Answer cache keyed by query meaning rather than query text.
+
+    For each data source (database, table and document spec) it keeps a small
+    matrix of L2-normalized query embeddings. A new query whose cosine distance
+    to a cached query is within ``max_distance`` and whose numbers and quoted
+    strings are the same (see :func:`extract_literals`) gets the cached answer. Entries
+    expire after ``ttl`` seconds and the least recently used one is evicted when
+    a source is full.
+    """
+
+    def __init__(self,
+                 max_distance: float = Config.SEMANTIC_CACHE_MAX_DISTANCE,
+                 ttl: float = Config.SEMANTIC_CACHE_TTL,
+                 max_entries_per_source: int = Config.SEMANTIC_CACHE_MAX_ENTRIES_PER_SOURCE,
+                 max_sources: int = Config.SEMANTIC_CACHE_MAX_SOURCES,
+                 dimension: int = Config.EMBEDDING_DIMENSION):
+        super().__init__()
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries_per_source = max_entries_per_source
+        self.max_sources = max_sources
+        self.dimension = dimension
+        self._sources = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def _normalize(self, vector) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if vector.shape != (self.dimension,) or norm == 0:
+            return None
+        return vector / norm
+
+    def get(self, source: Tuple, query: str, vector) -> Optional[Dict[str, Any]]:
+        """
+        Find the answer of the closest cached query of a data source.
+
+        :param source: Hashable key of the data source the query runs against.
+        :param query: Query string, whose literals must match the cached query's.
+        :param vector: Embedding of the query.
+        :return: ``{"query", "distance", "response"}`` of the closest cached query within
+            ``max_distance``, or None.
+        """
+        vector = self._normalize(vector)
+        literals = extract_literals(query)
+        with self._lock:
+            index = self._sources.get(source)
+            if vector is None or index is None:
+                self.misses += 1
+                return None
+            self._sources.move_to_end(source)
+            now = time.time()
+            self.expirations += index.expire(now, self.ttl)
+            similarities = index.similarities(vector, literals)
+            slot = int(np.argmax(similarities))
+            distance = 1.0 - float(similarities[slot])
+            if not np.isfinite(similarities[slot]) or distance > self.max_distance:
+                self.misses += 1
+                return None
+            index.last_access[slot] = now
+            self.hits += 1
+            return {"query": index.queries[slot], "distance": distance, "response": index.responses[slot]}
+
+    def put(self, source: Tuple, query: str, vector, response: Any, tags: Iterable[str],
+            generation: Optional[int] = None) -> None:
+        """
+        Store the answer of a query.
+
+        :param source: Hashable key of the data source the query ran against.
+        :param query: Query string.
+        :param vector: Embedding of the query.
+        :param response: Answer to return for similar queries.
+        :param tags: Data sources the answer was computed from, used by :meth:`invalidate`.
+        :param generation: Value of :attr:`generation` read before computing the answer;
+            the entry is dropped if an invalidation happened in between.
+        """
+        vector = self._normalize(vector)
+        if vector is None:
+            return
+        literals = extract_literals(query)
+        with self._lock:
+            if self._is_stale(generation):
+                return
+            index = self._sources.get(source)
+            if index is None:
+                index = _SourceIndex(self.max_entries_per_source, self.dimension, tags)
+                self._sources[source] = index
+                while len(self._sources) > self.max_sources:
+                    self._sources.popitem(last=False)
+            self._sources.move_to_end(source)
+            now = time.time()
+            self.expirations += index.expire(now, self.ttl)
+            similarities = index.similarities(vector, literals)
+            if np.isfinite(similarities.max()) and 1.0 - float(similarities.max()) <= self.max_distance:
+                # 已有同义的查询，直接覆盖它的答案
+                slot = int(np.argmax(similarities))
+            else:
+                slot, evicted = index.free_slot()
+                if evicted:
+                    self.evictions += 1
+            index.vectors[slot] = vector
+            index.valid[slot] = True
+            index.created[slot] = now
+            index.last_access[slot] = now
+            index.queries[slot] = query
+            index.literals[slot] = literals
+            index.responses[slot] = response
+
+    def _drop_tags(self, tags: Set[str]) -> None:
+        # 失效以数据源为单位，整个数据源的缓存一起丢掉
+        for source in [source for source, index in self._sources.items() if index.tags & tags]:
+            del self._sources[source]
+
+    def _drop_all(self) -> None:
+        self._sources.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "sources": len(self._sources),
+                "entries": sum(int(index.valid.sum()) for index in self._sources.values()),
+                "max_distance": self.max_distance,
+            }
@@ -1,6 +1,7 @@
 from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
+import bisect
 import re
-from typing import List, Optional, Any
+from typing import Iterable, Iterator, List, Optional, Tuple, Any
 
 
 def _split_text_with_regex_from_end(
@@ -167,3 +168,57 @@ class ChineseRecursiveTextSplitter(RecursiveCharacterTextSplitter):
             merged_text = self._merge_splits(_good_splits, _separator)
             final_chunks.extend(merged_text)
         return [re.sub(r"\n{2,}", "\n", chunk.strip()) for chunk in final_chunks if chunk.strip()!=""]
+
+    def split_text_stream(self, texts: Iterable[str], window: Optional[int] = None) -> Iterator[str]:
+        """
+        Split a stream of text pieces (e.g. pages) into chunks incrementally.
+
+        Text is buffered until it reaches ``window`` characters, then everything up to the
+        last line break or sentence end is split and yielded, and the tail is carried over.
+        Memory is bounded by the window instead of the document size.
+        """
+        for chunk, _ in self.split_text_stream_with_index(texts, window):
+            yield chunk
+
+    def split_text_stream_with_index(self, texts: Iterable[str], window: Optional[int] = None) -> Iterator[Tuple[str, int]]:
+        """
+        Same as :meth:`split_text_stream`, but yield ``(chunk, piece_index)`` where ``piece_index``
+        is the position in ``texts`` of the piece the chunk starts in (e.g. its page).
+        """
+        window = window or max(self._chunk_size * 20, 10000)
+        buffer = ""
+        # (在 buffer 中的起始位置, 文本片段序号)
+        starts = []
+        for index, text in enumerate(texts):
+            starts.append((len(buffer), index))
+            buffer += text
+            while len(buffer) >= window:
+                cut = self._find_boundary(buffer, window)
+                yield from self._locate_chunks(buffer[:cut], starts)
+                buffer = buffer[cut:]
+                starts = [(0, self._piece_at(starts, cut))] + [(start - cut, index) for start, index in starts if start > cut]
+        if buffer:
+            yield from self._locate_chunks(buffer, starts)
+
+    def _locate_chunks(self, text: str, starts: List[Tuple[int, int]]) -> Iterator[Tuple[str, int]]:
+        """Split ``text`` and find the piece each chunk starts in from the position of its first line."""
+        cursor = 0
+        for chunk in self.split_text(text):
+            # 分块经过 strip 和空行合并，用首行开头定位；找不到时沿用上一个分块的位置
+            position = text.find(chunk.split("\n", 1)[0][:20], cursor)
+            if position >= 0:
+                cursor = position
+            yield chunk, self._piece_at(starts, cursor)
+
+    @staticmethod
+    def _piece_at(starts: List[Tuple[int, int]], position: int) -> int:
+        return starts[bisect.bisect_right([start for start, _ in starts], position) - 1][1]
+
+    def _find_boundary(self, text: str, window: int) -> int:
+        """Position after the last line break, or failing that the last sentence end, within the window."""
+        for pattern in (r"\n", r"。|！|？|\.\s|\!\s|\?\s"):
+            matches = list(re.finditer(pattern, text[:window]))
+            # 边界太靠前的话，剩下的文本会越攒越多，这种情况直接在窗口处截断
+            if matches and matches[-1].end() > window // 2:
+                return matches[-1].end()
+        return window
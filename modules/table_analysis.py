@@ -5,45 +5,62 @@ from .tools.basic_tools import *
 from .tools.tabular_analysis import *
 from .tools.visualization import *
 
-from .utils import read_file_to_df, update_tools_with_columns
+from .utils import update_tools_with_columns
 
 import random
 import json
 
 class TableAnalysis():
     def __init__(self,
-                 dataframe):
-        self.dataframe = dataframe
-        self.tools = update_tools_with_columns(dataframe)
+                 table):
+        """
+        :param table: :class:`~modules.table_registry.TableView` of the table; each tool
+            loads only the columns it uses.
+        """
+        self.table = table
+        self.tools = update_tools_with_columns(table)
         self.tool_function_mapping = {
             'get_current_time': lambda: get_current_time(),
-            # 定位函数
-            'locate_specific_value': lambda args: locate_specific_value(self.dataframe, args['col_name_condition'], args['condition_value']),
-            'locate_greater_than_value': lambda args: locate_greater_than_value(self.dataframe, args['col_name_condition'], args['condition_value']),
-            'locate_less_than_value': lambda args: locate_less_than_value(self.dataframe, args['col_name_condition'], args['condition_value']),
+            # 定位函数：用条件列的索引查出行号，再只取出要返回的那一页行
+            'locate_specific_value': lambda args: self.locate(locate_specific_value, self.table.hash_index, args),
+            'locate_greater_than_value': lambda args: self.locate(locate_greater_than_value, self.table.sorted_index, args),
+            'locate_less_than_value': lambda args: self.locate(locate_less_than_value, self.table.sorted_index, args),
             # 描述函数
-            'describe_column': lambda args: describe_column(self.dataframe, args['col_name']),
-            'describe_dataframe': lambda args: describe_dataframe(self.dataframe),
+            'describe_column': lambda args: describe_column(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'describe_dataframe': lambda args: describe_dataframe(self.frame_for(self.table.numeric_columns or None, profiled=True), self.table.profile),
             # 计算函数
-            'calculate_correlation': lambda args: calculate_correlation(self.dataframe, args['col1'], args['col2']),
-            'calculate_covariance': lambda args: calculate_covariance(self.dataframe, args['col1'], args['col2']),
-            'calculate_skewness': lambda args: calculate_skewness(self.dataframe, args['col_name']),
-            'calculate_kurtosis': lambda args: calculate_kurtosis(self.dataframe, args['col_name']),
-            'calculate_percentile': lambda args: calculate_percentile(self.dataframe, args['col_name'], args['percentile']),
-            'calculate_coefficient_of_variation': lambda args: calculate_coefficient_of_variation(self.dataframe, args['col_name']),
-            'calculate_missing_value_ratio': lambda args: calculate_missing_value_ratio(self.dataframe, args['col_name']),
-            'calculate_unique_values': lambda args: calculate_unique_values(self.dataframe, args['col_name']),
-            'calculate_mode': lambda args: calculate_mode(self.dataframe, args['col_name']),
+            'calculate_correlation': lambda args: calculate_correlation(self.table.frame([args['col1'], args['col2']]), args['col1'], args['col2']),
+            'calculate_covariance': lambda args: calculate_covariance(self.table.frame([args['col1'], args['col2']]), args['col1'], args['col2']),
+            'calculate_skewness': lambda args: calculate_skewness(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'calculate_kurtosis': lambda args: calculate_kurtosis(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'calculate_percentile': lambda args: calculate_percentile(self.table.frame([args['col_name']]), args['col_name'], args['percentile']),
+            'calculate_coefficient_of_variation': lambda args: calculate_coefficient_of_variation(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'calculate_missing_value_ratio': lambda args: calculate_missing_value_ratio(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'calculate_unique_values': lambda args: calculate_unique_values(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
+            'calculate_mode': lambda args: calculate_mode(self.frame_for([args['col_name']], profiled=True), args['col_name'], self.table.profile),
             # 可视化函数
-            'plot_line_chart': lambda args: plot_line_chart(self.dataframe, args['col_name']),
-            'plot_bar_chart': lambda args: plot_bar_chart(self.dataframe, args['col_name']),
-            'plot_scatter_chart': lambda args: plot_scatter_chart(self.dataframe, args['x_col'], args['y_col']),
-            'plot_histogram': lambda args: plot_histogram(self.dataframe, args['col_name'], args.get('bins', 10)),
-            'plot_box_plot': lambda args: plot_box_plot(self.dataframe, args['col_name']),
-            'plot_pie_chart': lambda args: plot_pie_chart(self.dataframe, args['col_name']), 
+            'plot_line_chart': lambda args: plot_line_chart(self.table.frame([args['col_name']]), args['col_name']),
+            'plot_bar_chart': lambda args: plot_bar_chart(self.table.frame([args['col_name']]), args['col_name']),
+            'plot_scatter_chart': lambda args: plot_scatter_chart(self.table.frame([args['x_col'], args['y_col']]), args['x_col'], args['y_col']),
+            'plot_histogram': lambda args: plot_histogram(self.table.frame([args['col_name']]), args['col_name'], args.get('bins', 10)),
+            'plot_box_plot': lambda args: plot_box_plot(self.table.frame([args['col_name']]), args['col_name']),
+            'plot_pie_chart': lambda args: plot_pie_chart(self.table.frame([args['col_name']]), args['col_name']), 
 
         }
 
+    def frame_for(self, columns, profiled=False):
+        # 统计类工具在表格带有上传时算好的统计信息时直接读取统计信息，不必加载数据
+        if profiled and self.table.profile is not None:
+            return None
+        return self.table.frame(columns)
+
+    def locate(self, tool, get_index, args):
+        # 条件列没有可用的索引（列不存在、或范围查询的列不是数值列）时退回到扫描条件列
+        col_name = args['col_name_condition']
+        index = get_index(col_name)
+        df = self.table.frame([col_name]) if index is None else None
+        return tool(df, col_name, args['condition_value'], take=self.table.take, index=index, offset=args.get('offset', 0))
+
     def get_response(self, messages):
         response = Generation.call(
             model=Config.QWEN_MODEL,
@@ -90,11 +107,11 @@ class TableAnalysis():
             
 
 if __name__ == '__main__':
-    # 假设用户上传了一个包含销售额的Excel文件，实际应替换为用户上传文件的路径
-    file_path = "/root/Documents/ascend_rag/example_data/index.csv"
-    df = read_file_to_df(file_path)
+    from .table_registry import TableRegistry
+    # 假设用户上传的表格已保存为 tables/index.feather，实际应替换为上传后的表格名
+    table = TableRegistry("tables").view("index")
 
-    ta_chat = TableAnalysis(df)
+    ta_chat = TableAnalysis(table)
 
     # 用户输入示例
     user_input = "帮我把销售金额的走势画出来看看"
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+
+class HashIndex:
+    """
+    Equality lookup on one column: distinct values map to the row positions holding them.
+
+    Built with one ``factorize`` and one stable sort of the codes, so the positions of
+    each value are a contiguous slice already in row order.
+    """
+
+    def __init__(self, series: pd.Series):
+        codes, uniques = pd.factorize(series)
+        self.uniques = pd.Index(uniques)
+        # 缺失值的 code 为 -1，排序后在最前面，去掉它们
+        missing = int((codes < 0).sum())
+        self.positions = np.argsort(codes, kind="stable")[missing:]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.positions.nbytes + self.offsets.nbytes + self.uniques.memory_usage(deep=True))
+
+    def equal(self, value) -> np.ndarray:
+        """:return: Row positions where the column equals ``value``, in row order."""
+        code = self.uniques.get_indexer([value])[0]
+        if code < 0:
+            return self.positions[:0]
+        return self.positions[self.offsets[code]:self.offsets[code + 1]]
+
+
+class SortedIndex:
+    """Range lookup on one numeric column: non-missing values sorted, with their row positions."""
+
+    def __init__(self, series: pd.Series):
+        if pd.api.types.is_integer_dtype(series) and not series.hasnans:
+            values = series.to_numpy()
+        else:
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = np.flatnonzero(~np.isnan(values)) if values.dtype.kind == "f" else np.arange(len(values))
+        self.positions = valid[np.argsort(values[valid], kind="stable")]
+        self.values = values[self.positions]
+
+    @staticmethod
+    def supports(series: pd.Series) -> bool:
+        return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.positions.nbytes + self.values.nbytes)
+
+    def greater(self, value) -> np.ndarray:
+        """:return: Row positions where the column is greater than ``value``, in value order."""
+        return self.positions[np.searchsorted(self.values, float(value), side="right"):]
+
+    def less(self, value) -> np.ndarray:
+        """:return: Row positions where the column is less than ``value``, in value order."""
+        return self.positions[:np.searchsorted(self.values, float(value), side="left")]
@@ -0,0 +1,106 @@
+import math
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+
+from .table_registry import DATETIME_FORMAT
+
+# 描述性统计中的分位数，与 DataFrame.describe 默认一致
+QUANTILES = [0.25, 0.5, 0.75]
+
+
+def _scalar(value: Any) -> Any:
+    """Convert numpy scalars to Python values so the profile can be stored as JSON."""
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _is_numeric(series: pd.Series) -> bool:
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def _moments(values: np.ndarray) -> Dict[str, float]:
+    """Mean, sample std, skewness and excess kurtosis with the same bias corrections as pandas."""
+    n = len(values)
+    if n == 0:
+        return {"mean": math.nan, "std": math.nan, "skew": math.nan, "kurt": math.nan}
+    mean = values.mean()
+    deviations = values - mean
+    squared = deviations * deviations
+    m2 = squared.sum()
+    m3 = (squared * deviations).sum()
+    m4 = (squared * squared).sum()
+    std = math.sqrt(m2 / (n - 1)) if n > 1 else math.nan
+    if n < 3:
+        skew = math.nan
+    elif m2 == 0:
+        skew = 0.0
+    else:
+        skew = (n * math.sqrt(n - 1) / (n - 2)) * m3 / m2 ** 1.5
+    if n < 4:
+        kurt = math.nan
+    elif m2 == 0:
+        kurt = 0.0
+    else:
+        kurt = (n * (n + 1) * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2)
+                - 3 * (n - 1) ** 2 / ((n - 2) * (n - 3)))
+    return {"mean": float(mean), "std": std, "skew": skew, "kurt": kurt}
+
+
+def profile_column(series: pd.Series) -> Dict[str, Any]:
+    """
+    Statistics the table tools answer from, computed from one ``value_counts`` and,
+    for numeric columns, one pass over the non-missing values.
+
+    :return: ``count``, ``missing_ratio``, ``unique``, ``mode`` and the ``describe`` output of the
+        column; numeric columns also get ``mean``, ``std``, ``skew`` and ``kurt``.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        # 和查询时一样，先把日期时间格式化成字符串
+        series = series.dt.strftime(DATETIME_FORMAT).fillna("")
+    counts = series.value_counts(dropna=True)
+    count = int(counts.sum())
+    profile = {
+        "count": count,
+        "missing_ratio": (len(series) - count) / len(series) if len(series) else math.nan,
+        "unique": len(counts),
+        "mode": None,
+    }
+    if len(counts):
+        # 与 Series.mode() 一致：出现次数最多的值里取排序后的第一个
+        profile["mode"] = _scalar(counts.index[counts == counts.iloc[0]].sort_values()[0])
+
+    if _is_numeric(series):
+        values = series.dropna().to_numpy(dtype=np.float64)
+        moments = _moments(values)
+        quantiles = np.quantile(values, QUANTILES) if len(values) else [math.nan] * len(QUANTILES)
+        profile.update(moments)
+        profile["describe"] = {
+            "count": float(count),
+            "mean": moments["mean"],
+            "std": moments["std"],
+            "min": float(values.min()) if len(values) else math.nan,
+            **{f"{q:.0%}": float(value) for q, value in zip(QUANTILES, quantiles)},
+            "max": float(values.max()) if len(values) else math.nan,
+        }
+    else:
+        profile["describe"] = {
+            "count": count,
+            "unique": len(counts),
+            "top": _scalar(counts.index[0]) if len(counts) else math.nan,
+            "freq": int(counts.iloc[0]) if len(counts) else math.nan,
+        }
+    return profile
+
+
+def profile_table(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    :return: ``rows``, the names of the ``numeric_columns`` and the profile of every column.
+    """
+    return {
+        "rows": len(df),
+        "numeric_columns": [column for column in df.columns if _is_numeric(df[column])],
+        "columns": {column: profile_column(df[column]) for column in df.columns},
+    }
@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from .config import Config
+from .table_index import HashIndex, SortedIndex
+
+# 日期时间列统一格式化成的字符串格式，空值为空字符串
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+TABLE_EXTENSION = ".feather"
+
+
+def prepare_table(df: pd.DataFrame) -> pd.DataFrame:
+    """Format datetime columns as strings once, vectorized, so tool output is JSON serializable."""
+    for column in df.select_dtypes(include=["datetime", "datetimetz"]):
+        df[column] = df[column].dt.strftime(DATETIME_FORMAT).fillna("")
+    return df
+
+
+class _Table:
+    """Memory-mapped Arrow table of one uploaded file; columns are only read when converted."""
+
+    def __init__(self, path: str, signature):
+        self.signature = signature
+        self.arrow = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        self.columns = self.arrow.column_names
+        # 上传时算好的列统计信息，旧版本保存的表格没有
+        metadata = self.arrow.schema.metadata or {}
+        self.profile = json.loads(metadata[b"profile"]) if b"profile" in metadata else None
+        # 每个记录批次的起始行号，take 时按批次取行
+        self.batches = self.arrow.to_batches()
+        self.offsets = np.cumsum([0] + [batch.num_rows for batch in self.batches])
+
+    def take(self, rows) -> pa.Table:
+        """
+        Rows at the given positions, in that order. Taking from the chunked table directly
+        scans every chunk, so rows are taken from the record batch holding them instead.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        ordered = rows[order]
+        batch_of = np.searchsorted(self.offsets, ordered, side="right") - 1
+        parts = []
+        for batch_index in np.unique(batch_of):
+            local = ordered[batch_of == batch_index] - self.offsets[batch_index]
+            parts.append(self.batches[batch_index].take(pa.array(local)))
+        taken = pa.Table.from_batches(parts, schema=self.arrow.schema) if parts else self.arrow.slice(0, 0)
+        # 按传入的顺序还原
+        return taken.take(pa.array(np.argsort(order, kind="stable")))
+
+
+class TableView:
+    """
+    Column-projected access to one uploaded table through a :class:`TableRegistry`.
+
+    Tools ask for the columns they use with :meth:`frame`, or for a few whole rows with
+    :meth:`take`, so only those are materialized.
+    """
+
+    def __init__(self, registry: "TableRegistry", table_name: str):
+        self.registry = registry
+        self.table_name = table_name
+        self.columns = registry.columns(table_name)
+        # 数值列，describe_dataframe 只需要这些列（与 DataFrame.describe 的默认行为一致）
+        self.numeric_columns = registry.numeric_columns(table_name)
+        self.profile = registry.profile(table_name)
+
+    def __len__(self) -> int:
+        return self.registry.num_rows(self.table_name)
+
+    def frame(self, columns: Optional[Iterable[str]] = None) -> pd.DataFrame:
+        """
+        :param columns: Columns to load, all columns when None. Unknown names are skipped,
+            so the tool reading them reports the missing column itself.
+        """
+        columns = self.columns if columns is None else [column for column in columns if column in self.columns]
+        return self.registry.frame(self.table_name, columns)
+
+    def take(self, rows) -> pd.DataFrame:
+        """:return: Full rows at the given positions, read straight from the memory-mapped file."""
+        return self.registry.take(self.table_name, rows)
+
+    def hash_index(self, column: str) -> Optional[HashIndex]:
+        """:return: Equality index of the column, None for unknown columns."""
+        return self.registry.index(self.table_name, column, "hash") if column in self.columns else None
+
+    def sorted_index(self, column: str) -> Optional[SortedIndex]:
+        """:return: Range index of the column, None for unknown or non-numeric columns."""
+        return self.registry.index(self.table_name, column, "sorted") if column in self.columns else None
+
+
+class TableRegistry:
+    """
+    Uploaded tables stored as uncompressed Feather (Arrow IPC) files in ``folder``.
+
+    Files are memory-mapped on first use. Columns are converted to pandas, prepared
+    with :func:`prepare_table` and cached individually, so memory grows with the
+    columns that are actually queried rather than the width of the sheet. Lookup
+    indexes of columns are built on demand and cached the same way. A table is
+    reopened and its cached columns and indexes dropped when the modification time
+    or size of its file changes. When the cache exceeds ``max_bytes`` the least
+    recently used entries are evicted. Returned frames are shared between requests and must not
+    be modified.
+    """
+
+    def __init__(self, folder: str, max_bytes: int = Config.TABLE_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._tables = {}
+        # (表名, "column" 或索引类型, 列名) -> (列或索引, 字节数)，按最近使用排序
+        self._cache = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def path(self, table_name: str) -> str:
+        return os.path.join(self.folder, f"{table_name}{TABLE_EXTENSION}")
+
+    def exists(self, table_name: str) -> bool:
+        return os.path.exists(self.path(table_name))
+
+    def view(self, table_name: str) -> TableView:
+        return TableView(self, table_name)
+
+    @staticmethod
+    def _signature(path: str):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_lock(self, table_name: str) -> threading.Lock:
+        with self._lock:
+            return self._load_locks.setdefault(table_name, threading.Lock())
+
+    def _table(self, table_name: str) -> _Table:
+        """
+        :return: Open table, reopened if its file changed.
+        :raises FileNotFoundError: If the table was never uploaded.
+        """
+        path = self.path(table_name)
+        signature = self._signature(path)
+        with self._lock:
+            table = self._tables.get(table_name)
+            if table is not None and table.signature == signature:
+                return table
+        table = _Table(path, signature)
+        with self._lock:
+            self._forget(table_name)
+            self._tables[table_name] = table
+        return table
+
+    def columns(self, table_name: str) -> List[str]:
+        return self._table(table_name).columns
+
+    def numeric_columns(self, table_name: str) -> List[str]:
+        schema = self._table(table_name).arrow.schema
+        return [field.name for field in schema
+                if pa.types.is_integer(field.type) or pa.types.is_floating(field.type) or pa.types.is_decimal(field.type)]
+
+    def profile(self, table_name: str) -> Optional[Dict[str, Any]]:
+        """:return: Column statistics computed at upload, see :func:`~modules.table_profile.profile_table`."""
+        return self._table(table_name).profile
+
+    def num_rows(self, table_name: str) -> int:
+        return self._table(table_name).arrow.num_rows
+
+    def frame(self, table_name: str, columns: List[str]) -> pd.DataFrame:
+        """:return: Prepared frame holding only ``columns``, in that order."""
+        # 同一张表同时只加载一次，其他请求等它加载完直接命中
+        with self._load_lock(table_name):
+            table = self._table(table_name)
+            series = {}
+            with self._lock:
+                for column in columns:
+                    cached = self._cached((table_name, "column", column))
+                    if cached is not None:
+                        series[column] = cached
+            missing = [column for column in columns if column not in series]
+            if missing:
+                loaded = prepare_table(table.arrow.select(missing).to_pandas())
+                with self._lock:
+                    for column in missing:
+                        series[column] = loaded[column]
+                        self._store((table_name, "column", column), loaded[column],
+                                    int(loaded[column].memory_usage(index=False, deep=True)))
+                    self._evict(keep=len(missing))
+        # copy=False 让返回的 DataFrame 直接引用缓存的列
+        return pd.DataFrame({column: series[column] for column in columns}, index=pd.RangeIndex(table.arrow.num_rows), copy=False)
+
+    def index(self, table_name: str, column: str, kind: str):
+        """
+        Lookup structure of a column, built on first use and cached like the columns.
+
+        :param kind: ``"hash"`` for :class:`~modules.table_index.HashIndex` (equality) or
+            ``"sorted"`` for :class:`~modules.table_index.SortedIndex` (ranges).
+        :return: The index, or None for a sorted index on a non-numeric column.
+        """
+        key = (table_name, kind, column)
+        with self._lock:
+            cached = self._cached(key)
+        if cached is not None:
+            return cached
+        series = self.frame(table_name, [column])[column]
+        if kind == "sorted" and not SortedIndex.supports(series):
+            return None
+        with self._load_lock(table_name):
+            with self._lock:
+                cached = self._cached(key)
+            if cached is not None:
+                return cached
+            index = HashIndex(series) if kind == "hash" else SortedIndex(series)
+            with self._lock:
+                self._store(key, index, index.nbytes)
+                self._evict(keep=1)
+        return index
+
+    def take(self, table_name: str, rows) -> pd.DataFrame:
+        return prepare_table(self._table(table_name).take(rows).to_pandas())
+
+    def _cached(self, key):
+        cached = self._cache.get(key)
+        if cached is None:
+            return None
+        self._cache.move_to_end(key)
+        self.hits += 1
+        return cached[0]
+
+    def _store(self, key, value, nbytes: int) -> None:
+        self._cache[key] = (value, nbytes)
+        self._bytes += nbytes
+        self.loads += 1
+
+    def _evict(self, keep: int) -> None:
+        # 刚加载的列和索引总是保留，即使它们本身超出预算
+        while self._bytes > self.max_bytes and len(self._cache) > keep:
+            _, (_, nbytes) = self._cache.popitem(last=False)
+            self._bytes -= nbytes
+            self.evictions += 1
+
+    def _forget(self, table_name: str) -> None:
+        self._tables.pop(table_name, None)
+        for key in [key for key in self._cache if key[0] == table_name]:
+            self._bytes -= self._cache.pop(key)[1]
+
+    def invalidate(self, table_name: str) -> None:
+        with self._lock:
+            self._forget(table_name)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+            self._cache.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "tables": list(self._tables),
+                "cached_columns": sum(1 for _, kind, _ in self._cache if kind == "column"),
+                "cached_indexes": sum(1 for _, kind, _ in self._cache if kind != "column"),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -1,17 +1,32 @@
 import pandas as pd
 import numpy as np
 
+from ..config import Config
+
+# profile 为上传时算好的列统计信息（见 modules/table_profile.py），传入时直接从中取值，不再扫描 df
+def _profiled_stat(profile, col_name, stat):
+    column = profile['columns'][col_name]
+    if stat not in column:
+        raise TypeError(f"Column '{col_name}' is not numeric.")
+    return column[stat]
+
 # 对某列进行基本数据描述性分析的工具
-def describe_column(df, col_name):
+def describe_column(df, col_name, profile=None):
     try:
+        if profile is not None:
+            return profile['columns'][col_name]['describe']
         description = df[col_name].describe().to_dict()
         return description
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 对整个数据框进行总体描述的工具
-def describe_dataframe(df):
+def describe_dataframe(df, profile=None):
     try:
+        if profile is not None:
+            # 与 DataFrame.describe 一致：有数值列时只描述数值列
+            columns = profile['numeric_columns'] or list(profile['columns'])
+            return {column: profile['columns'][column]['describe'] for column in columns}
         description = df.describe().to_dict()
         return description
     except Exception as e:
@@ -34,17 +49,17 @@ def calculate_covariance(df, col1, col2):
         return f"Column '{str(e)}' does not exist in the dataframe."
 
 # 计算一列的偏度
-def calculate_skewness(df, col_name):
+def calculate_skewness(df, col_name, profile=None):
     try:
-        skewness = df[col_name].skew()
+        skewness = _profiled_stat(profile, col_name, 'skew') if profile is not None else df[col_name].skew()
         return {f'Skewness of {col_name}': skewness}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 计算一列的峰度
-def calculate_kurtosis(df, col_name):
+def calculate_kurtosis(df, col_name, profile=None):
     try:
-        kurtosis = df[col_name].kurt()
+        kurtosis = _profiled_stat(profile, col_name, 'kurt') if profile is not None else df[col_name].kurt()
         return {f'Kurtosis of {col_name}': kurtosis}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
@@ -58,35 +73,44 @@ def calculate_percentile(df, col_name, percentile):
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 计算一列的变异系数
-def calculate_coefficient_of_variation(df, col_name):
+def calculate_coefficient_of_variation(df, col_name, profile=None):
     try:
-        mean = df[col_name].mean()
-        std = df[col_name].std()
+        if profile is not None:
+            mean = _profiled_stat(profile, col_name, 'mean')
+            std = _profiled_stat(profile, col_name, 'std')
+        else:
+            mean = df[col_name].mean()
+            std = df[col_name].std()
         cv = std / mean if mean != 0 else float('inf')
         return {f'Coefficient of Variation of {col_name}': cv}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 计算一列的缺失值比例
-def calculate_missing_value_ratio(df, col_name):
+def calculate_missing_value_ratio(df, col_name, profile=None):
     try:
-        missing_ratio = df[col_name].isna().mean()
+        missing_ratio = profile['columns'][col_name]['missing_ratio'] if profile is not None else df[col_name].isna().mean()
         return {f'Missing Value Ratio of {col_name}': missing_ratio}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 计算一列的唯一值个数
-def calculate_unique_values(df, col_name):
+def calculate_unique_values(df, col_name, profile=None):
     try:
-        unique_values_count = df[col_name].nunique()
+        unique_values_count = profile['columns'][col_name]['unique'] if profile is not None else df[col_name].nunique()
         return {f'Unique Values Count of {col_name}': unique_values_count}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
 
 # 计算一列的最常见值（众数）
-def calculate_mode(df, col_name):
+def calculate_mode(df, col_name, profile=None):
     try:
-        mode_value = df[col_name].mode().iloc[0]
+        if profile is not None:
+            mode_value = profile['columns'][col_name]['mode']
+            if mode_value is None:
+                raise IndexError(col_name)
+        else:
+            mode_value = df[col_name].mode().iloc[0]
         return {f'Mode of {col_name}': mode_value}
     except KeyError:
         return f"Column '{col_name}' does not exist in the dataframe."
@@ -94,13 +118,42 @@ def calculate_mode(df, col_name):
         return f"No mode found for column '{col_name}'. The column might be empty."
     
 
-# 定位特定行的所有列数据的工具
-def locate_specific_value(df, col_name_condition, condition_value):
+# 按行号顺序取出第 offset 条起最多 limit 条匹配的行；匹配行超出一页时附带总数，提示模型用 offset 翻页
+def _matching_rows(df, matches, take, condition, limit, offset):
+    total = len(matches)
+    if total == 0:
+        return f"No matching rows found for the given condition: {condition}"
+    offset = max(int(offset or 0), 0)
+    if offset >= total:
+        return f"Offset {offset} is beyond the last matching row (total {total}) for the given condition: {condition}"
+    end = min(offset + limit, total)
+    if end < total:
+        # 只需要行号最小的 end 个，partition 是线性的，不用对全部匹配行排序
+        selected = np.sort(np.partition(matches, end - 1)[:end])[offset:]
+    else:
+        selected = np.sort(matches)[offset:end]
+    rows = (take(selected) if take is not None else df.iloc[selected]).to_dict(orient='records')
+    if offset == 0 and total <= limit:
+        return rows
+    return {
+        "total_matches": total,
+        "offset": offset,
+        "returned": len(rows),
+        "rows": rows,
+        "note": f"Showing matching rows {offset + 1}-{offset + len(rows)} of {total}"
+                + ("; pass offset to see more." if end < total else "."),
+    }
+
+# 定位特定行的所有列数据的工具；take(行号数组) 返回这些行的所有列，df 只需包含条件列；
+# index 为条件列的 HashIndex / SortedIndex（见 modules/table_index.py），传入时不再扫描 df
+def locate_specific_value(df, col_name_condition, condition_value, take=None, index=None,
+                          limit=Config.TABLE_LOCATE_MAX_ROWS, offset=0):
     try:
-        specific_value = df.loc[df[col_name_condition] == condition_value]
-        if specific_value.empty:
-            return f"No matching rows found for the given condition: {col_name_condition} = {condition_value}"
-        return specific_value.to_dict(orient='records')
+        if index is not None:
+            matches = index.equal(condition_value)
+        else:
+            matches = np.flatnonzero(df[col_name_condition] == condition_value)
+        return _matching_rows(df, matches, take, f"{col_name_condition} = {condition_value}", limit, offset)
     except KeyError as e:
         return f"Column '{str(e)}' does not exist in the dataframe."
     except Exception as e:
@@ -108,25 +161,29 @@ def locate_specific_value(df, col_name_condition, condition_value):
     
 
 # 查找大于特定值的行的所有列数据的工具
-def locate_greater_than_value(df, col_name_condition, condition_value):
+def locate_greater_than_value(df, col_name_condition, condition_value, take=None, index=None,
+                              limit=Config.TABLE_LOCATE_MAX_ROWS, offset=0):
     try:
-        specific_value = df.loc[df[col_name_condition] > condition_value]
-        if specific_value.empty:
-            return f"No matching rows found for the given condition: {col_name_condition} > {condition_value}"
-        return specific_value.to_dict(orient='records')
+        if index is not None:
+            matches = index.greater(condition_value)
+        else:
+            matches = np.flatnonzero(df[col_name_condition] > condition_value)
+        return _matching_rows(df, matches, take, f"{col_name_condition} > {condition_value}", limit, offset)
     except KeyError as e:
         return f"Column '{str(e)}' does not exist in the dataframe."
     except Exception as e:
         return str(e)
     
 # 查找小于特定值的行的所有列数据的工具
-def locate_less_than_value(df, col_name_condition, condition_value):
+def locate_less_than_value(df, col_name_condition, condition_value, take=None, index=None,
+                           limit=Config.TABLE_LOCATE_MAX_ROWS, offset=0):
     try:
-        specific_value = df.loc[df[col_name_condition] < condition_value]
-        if specific_value.empty:
-            return f"No matching rows found for the given condition: {col_name_condition} < {condition_value}"
-        return specific_value.to_dict(orient='records')
+        if index is not None:
+            matches = index.less(condition_value)
+        else:
+            matches = np.flatnonzero(df[col_name_condition] < condition_value)
+        return _matching_rows(df, matches, take, f"{col_name_condition} < {condition_value}", limit, offset)
     except KeyError as e:
         return f"Column '{str(e)}' does not exist in the dataframe."
     except Exception as e:
-        return str(e)
\ No newline at end of file
+        return str(e)
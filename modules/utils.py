@@ -1,42 +1,191 @@
-import pandas as pd 
-import os 
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
-# 读取Excel或CSV文件并转换为DataFrame
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+from pyarrow import feather
+
+from .config import Config
+from .table_profile import profile_table
+
+
+# 读取Excel或CSV文件并转换为DataFrame（Excel 只取第一个工作表）
 def read_file_to_df(file_path: str, file_extension) -> pd.DataFrame:
+    df, _ = next(iter(read_file_to_tables(file_path, file_extension).values()))
+    return df
+
+# 分块读取Excel或CSV文件，每个工作表一个 DataFrame，返回 {工作表名: (DataFrame, 读取统计)}，CSV 的工作表名为 None
+def read_file_to_tables(file_path: str, file_extension,
+                        chunk_rows: int = Config.TABLE_READ_CHUNK_ROWS) -> Dict[Optional[str], Tuple[pd.DataFrame, Dict[str, Any]]]:
+    file_extension = file_extension.lower()
     if file_extension == '.csv':
-        df = pd.read_csv(file_path)
-    elif file_extension in ['.xls', '.xlsx']:
-        df = pd.read_excel(file_path)
-    else:
-        raise ValueError("Unsupported file type")
+        return {None: read_table_chunks(pd.read_csv(file_path, chunksize=chunk_rows))}
+    if file_extension == '.xlsx':
+        return {sheet_name: read_table_chunks(chunks) for sheet_name, chunks in iter_excel_sheets(file_path, chunk_rows)}
+    if file_extension == '.xls':
+        # openpyxl 不支持 .xls，只能整表读取
+        return {sheet_name: read_table_chunks([df]) for sheet_name, df in pd.read_excel(file_path, sheet_name=None).items()}
+    raise ValueError("Unsupported file type")
+
+# 以只读模式流式读取 .xlsx 的每个工作表，按 chunk_rows 行一块产出 DataFrame，第一行为表头
+def iter_excel_sheets(file_path: str, chunk_rows: int) -> Iterator[Tuple[str, Iterator[pd.DataFrame]]]:
+    from openpyxl import load_workbook
+    # 传文件对象而不是路径：上传的临时文件没有扩展名，openpyxl 会按扩展名拒绝
+    with open(file_path, 'rb') as f:
+        workbook = load_workbook(f, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                rows = worksheet.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                yield worksheet.title, _iter_row_chunks(rows, _unique_headers(header), chunk_rows)
+        finally:
+            workbook.close()
+
+def _iter_row_chunks(rows, columns: List[str], chunk_rows: int) -> Iterator[pd.DataFrame]:
+    chunk = []
+    yielded = False
+    for row in rows:
+        # 跳过整行为空的行（只读模式下工作表末尾常有格式残留的空行）
+        if all(value is None for value in row):
+            continue
+        chunk.append(row[:len(columns)])
+        if len(chunk) >= chunk_rows:
+            yield _rows_to_frame(chunk, columns)
+            chunk = []
+            yielded = True
+    # 只有表头的工作表也产出一块空数据，保留表头的列
+    if chunk or not yielded:
+        yield _rows_to_frame(chunk, columns)
+
+def _rows_to_frame(rows, columns: List[str]) -> pd.DataFrame:
+    df = pd.DataFrame(rows, columns=columns).infer_objects()
+    # 与 pd.read_excel 一致：整列为空的列为 float64，否则数值列某一块全空时合并后会变成 object
+    for column in columns:
+        if len(df) and df[column].dtype == object and df[column].isna().all():
+            df[column] = df[column].astype(np.float64)
     return df
 
-# 将DataFrame保存为pickle文件
-def save_df_to_pickle(df: pd.DataFrame, file_name: str, file_path: str):
-    pickle_path = os.path.join(file_path, f"{file_name}.pkl")
-    df.to_pickle(pickle_path)
+def _unique_headers(header) -> List[str]:
+    # 与 pd.read_excel 一致：空表头为 "Unnamed: i"，重复的表头加上 ".1"、".2" 后缀
+    columns = []
+    seen = {}
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    return columns
 
+# 把分块读取的 DataFrame 压缩类型后合并，返回合并结果和读取统计（行数、每秒行数、压缩前后的内存）
+def read_table_chunks(chunks) -> Tuple[pd.DataFrame, Dict[str, Any]]:
+    start = time.perf_counter()
+    optimized = []
+    naive_bytes = 0
+    for chunk in chunks:
+        naive_bytes += int(chunk.memory_usage(index=False, deep=True).sum())
+        optimized.append(optimize_dtypes(chunk))
+    df = concat_chunks(optimized)
+    seconds = time.perf_counter() - start
+    memory_bytes = int(df.memory_usage(index=False, deep=True).sum())
+    stats = {
+        "rows": len(df),
+        "columns": len(df.columns),
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(len(df) / seconds) if seconds > 0 else None,
+        "naive_bytes": naive_bytes,
+        "bytes": memory_bytes,
+        "memory_saved_bytes": naive_bytes - memory_bytes,
+        "memory_saved_ratio": round(1 - memory_bytes / naive_bytes, 3) if naive_bytes else None,
+    }
+    return df, stats
 
-# 读取Excel或CSV文件并转换为DataFrame
-def read_file_to_df(file_path: str, file_extension) -> pd.DataFrame:
-    if file_extension == '.csv':
-        df = pd.read_csv(file_path)
-    elif file_extension in ['.xls', '.xlsx']:
-        df = pd.read_excel(file_path)
-    else:
-        raise ValueError("Unsupported file type")
+# 压缩一块数据的列类型：整数降到最小的整型，能无损表示的浮点数降为 float32，低基数的字符串列转为 category
+def optimize_dtypes(df: pd.DataFrame, category_max_ratio: float = Config.TABLE_CATEGORY_MAX_RATIO) -> pd.DataFrame:
+    for column in df.columns:
+        series = df[column]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            df[column] = pd.to_numeric(series, downcast='integer')
+        elif pd.api.types.is_float_dtype(series):
+            downcast = series.astype(np.float32)
+            if np.array_equal(downcast.to_numpy(dtype=np.float64), series.to_numpy(dtype=np.float64), equal_nan=True):
+                df[column] = downcast
+        elif pd.api.types.infer_dtype(series, skipna=True) == 'string':
+            # 只转换纯字符串列，混合类型的列存 feather 时会统一转成字符串
+            if len(series) and series.nunique() <= category_max_ratio * len(series):
+                df[column] = series.astype('category')
     return df
 
-# 将DataFrame保存为pickle文件
-def save_df_to_pickle(df: pd.DataFrame, file_name: str, file_path: str):
-    pickle_path = os.path.join(file_path, f"{file_name}.pkl")
-    df.to_pickle(pickle_path)
+# 合并分块：除整块为空的块外都是 category 的列用 union_categoricals 合并类别，只有部分块是 category 的列还原为普通值
+def concat_chunks(chunks: List[pd.DataFrame]) -> pd.DataFrame:
+    if not chunks:
+        return pd.DataFrame()
+    if len(chunks) == 1:
+        return chunks[0].reset_index(drop=True)
+    columns = list(chunks[0].columns)
+    categorical = {}
+    for column in columns:
+        categories = [chunk[column] for chunk in chunks if isinstance(chunk[column].dtype, pd.CategoricalDtype)]
+        if categories and all(isinstance(chunk[column].dtype, pd.CategoricalDtype) or chunk[column].isna().all()
+                              for chunk in chunks):
+            categorical[column] = categories[0].cat.categories[:0]
+    for chunk in chunks:
+        for column in columns:
+            if column in categorical and not isinstance(chunk[column].dtype, pd.CategoricalDtype):
+                # 整块为空的块补成没有类别的 category，合并后仍是 category 列
+                chunk[column] = pd.Categorical.from_codes(np.full(len(chunk), -1),
+                                                          dtype=pd.CategoricalDtype(categorical[column]))
+            elif column not in categorical and isinstance(chunk[column].dtype, pd.CategoricalDtype):
+                chunk[column] = chunk[column].astype(chunk[column].cat.categories.dtype)
+    # 字符串列中整块为空的块按其他块的类型转换，否则合并后整列变成 object
+    for column in columns:
+        if column in categorical:
+            continue
+        dtypes = {chunk[column].dtype for chunk in chunks if not chunk[column].isna().all()}
+        if len(dtypes) == 1 and isinstance(next(iter(dtypes)), pd.StringDtype):
+            for chunk in chunks:
+                if chunk[column].isna().all():
+                    chunk[column] = chunk[column].astype(next(iter(dtypes)))
+    df = pd.concat([chunk.drop(columns=list(categorical)) for chunk in chunks], ignore_index=True)
+    for column in categorical:
+        df[column] = union_categoricals([chunk[column] for chunk in chunks])
+    return df[columns]
+
+# 将DataFrame保存为不压缩的feather（Arrow IPC）文件，读取时可以内存映射并只加载用到的列；同时保存各列的统计信息
+def save_df_to_feather(df: pd.DataFrame, file_name: str, file_path: str):
+    df = df.reset_index(drop=True)
+    # Arrow 要求列名是字符串，且每列类型一致；混合类型的列按字符串保存
+    df.columns = [str(column) for column in df.columns]
+    for column in df.select_dtypes(include=['object']):
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            df[column] = df[column].map(lambda x: x if pd.isna(x) else str(x))
+    # 列统计信息只在上传时算一次，和数据一起写进文件的 schema 元数据，表格工具直接读取
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = {**(table.schema.metadata or {}), b'profile': json.dumps(profile_table(df), ensure_ascii=False).encode('utf-8')}
+    table = table.replace_schema_metadata(metadata)
+    feather_path = os.path.join(file_path, f"{file_name}.feather")
+    # 先写临时文件再替换，正在被内存映射读取的旧文件不受影响
+    tmp_path = f"{feather_path}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, feather_path)
 
 
 # 注册工具函数
 def update_tools_with_columns(df):
     tool_list = []
-    columns = df.columns.tolist()
+    columns = list(df.columns)
     column_names = ", ".join(columns)
 
     describe_description = f"对指定DataFrame列进行基本数据描述性分析，包括最大值、最小值、均值、方差、分位数等。可以问例如：'请描述列A的统计信息'，或者'列B的平均值是多少？'。可用的列名有：{column_names}。"
@@ -293,6 +442,11 @@ def update_tools_with_columns(df):
                         "condition_value": {
                             "type": "string",
                             "description": "要匹配的条件值，例如'李华'。"
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "匹配的行较多时只返回一页，跳过前多少条匹配的行用于翻页，默认0。",
+                            "default": 0
                         }
                     },
                     "required": ["col_name_condition", "condition_value"]
@@ -319,6 +473,11 @@ def update_tools_with_columns(df):
                         "condition_value": {
                             "type": "number",
                             "description": "要比较的条件值，例如'3500'。"
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "匹配的行较多时只返回一页，跳过前多少条匹配的行用于翻页，默认0。",
+                            "default": 0
                         }
                     },
                     "required": ["col_name_condition", "condition_value"]
@@ -345,6 +504,11 @@ def update_tools_with_columns(df):
                         "condition_value": {
                             "type": "number",
                             "description": "要比较的条件值，例如'160'。"
+                        },
+                        "offset": {
+                            "type": "integer",
+                            "description": "匹配的行较多时只返回一页，跳过前多少条匹配的行用于翻页，默认0。",
+                            "default": 0
                         }
                     },
                     "required": ["col_name_condition", "condition_value"]
@@ -1,34 +1,365 @@
+import heapq
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import numpy as np
 from pymilvus import MilvusClient, DataType
+from .config import Config
+
+# 分块除文本和向量外保存的元数据：来源文件、起始页码（无页码的文件为 0）、在文档中的序号、内容哈希
+METADATA_FIELDS = ["source", "page", "chunk_index", "content_hash"]
+# 支持的距离度量，以及各索引类型可以指定的建索引参数
+METRIC_TYPES = ("COSINE", "IP", "L2")
+INDEX_BUILD_PARAMS = {
+    "AUTOINDEX": (),
+    "FLAT": (),
+    "IVF_FLAT": ("nlist",),
+    "IVF_SQ8": ("nlist",),
+    "IVF_PQ": ("nlist", "m", "nbits"),
+    "HNSW": ("M", "efConstruction"),
+    "SCANN": ("nlist", "with_raw_data"),
+    "DISKANN": (),
+}
+
+
+def metric_distances(queries: np.ndarray, vectors: np.ndarray, metric_type: str) -> np.ndarray:
+    """
+    :return: ``(len(queries), len(vectors))`` matrix of the distances Milvus reports for ``metric_type``:
+        squared euclidean distance for L2 (smaller is closer), cosine similarity or inner product otherwise.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if metric_type == "L2":
+        return (queries ** 2).sum(axis=1, keepdims=True) - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)
+    if metric_type == "COSINE":
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+    return queries @ vectors.T
+# 内部临时集合（例如索引基准测试用的副本）的名称前缀，上传的文档不能使用，也不出现在集合列表和 * 搜索中
+RESERVED_COLLECTION_PREFIX = "__index_benchmark_"
 
 class MilvusHelper:
-    def __init__(self, db_folder='milvus_db'):
+    def __init__(self, db_folder='milvus_db', idle_timeout=Config.MILVUS_CLIENT_IDLE_TIMEOUT):
         self.db_folder = db_folder
         if not os.path.exists(self.db_folder):
             os.makedirs(self.db_folder)
-    
+        self.idle_timeout = idle_timeout
+        # 按 db_name 复用已打开的客户端，避免每个请求都重新打开 Milvus Lite 数据库文件
+        self._clients = {}
+        self._last_used = {}
+        self._write_locks = {}
+        self._registry_lock = threading.Lock()
+        self._reaper_stop = threading.Event()
+        self._reaper = None
+        # 跨集合搜索时并发查询各个集合
+        self._search_executor = ThreadPoolExecutor(max_workers=Config.MILVUS_SEARCH_MAX_WORKERS,
+                                                   thread_name_prefix="milvus-search")
+        # (客户端, 集合名) -> 索引设置，省得每次搜索都去读集合属性
+        self._settings_cache = {}
+
     def get_milvus_client(self, db_name):
-        db_path = os.path.join(self.db_folder, f"{db_name}.db")
-        return MilvusClient(db_path)
+        with self._registry_lock:
+            client = self._clients.get(db_name)
+            if client is None:
+                db_path = os.path.join(self.db_folder, f"{db_name}.db")
+                client = MilvusClient(db_path)
+                self._clients[db_name] = client
+            self._last_used[db_name] = time.monotonic()
+            return client
 
-    def create_collection(self, client, collection_name):
-        if not client.has_collection(collection_name):
-            client.create_collection(collection_name, dimension=1536)
+    def write_lock(self, db_name):
+        """Lock serializing writers of one database file."""
+        with self._registry_lock:
+            return self._write_locks.setdefault(db_name, threading.RLock())
 
-    def insert_data(self, client, collection_name, texts, embeddings):
-        data = [
-            {"id": i, "vector": embeddings[i], "text": texts[i], "subject": "history"}
-            for i in range(len(embeddings))
-        ]
-        client.insert(collection_name, data)
+    @contextmanager
+    def writer(self, db_name):
+        """Yield the client of ``db_name`` while holding its write lock."""
+        with self.write_lock(db_name):
+            yield self.get_milvus_client(db_name)
+
+    def close_client(self, db_name):
+        with self.write_lock(db_name):
+            with self._registry_lock:
+                client = self._clients.pop(db_name, None)
+                self._last_used.pop(db_name, None)
+            if client is not None:
+                self._forget_settings(client)
+                client.close()
+
+    def _forget_settings(self, client):
+        for key in [key for key in self._settings_cache if key[0] == id(client)]:
+            self._settings_cache.pop(key, None)
+
+    def close_idle_clients(self):
+        now = time.monotonic()
+        with self._registry_lock:
+            idle = [db_name for db_name, last_used in self._last_used.items() if now - last_used > self.idle_timeout]
+        for db_name in idle:
+            with self.write_lock(db_name):
+                with self._registry_lock:
+                    # 拿到写锁之后再确认一次，期间可能又被使用过
+                    if now - self._last_used.get(db_name, now) <= self.idle_timeout:
+                        continue
+                    client = self._clients.pop(db_name)
+                    self._last_used.pop(db_name)
+                self._forget_settings(client)
+                client.close()
+                print(f"Closed idle milvus client for {db_name}")
+
+    def start_reaper(self, interval=None):
+        """Start a daemon thread that periodically closes idle clients."""
+        if self._reaper is not None:
+            return
+        interval = interval or max(self.idle_timeout / 2, 1)
+
+        def reap():
+            while not self._reaper_stop.wait(interval):
+                self.close_idle_clients()
+
+        self._reaper_stop.clear()
+        self._reaper = threading.Thread(target=reap, name="milvus-client-reaper", daemon=True)
+        self._reaper.start()
+
+    def stop_reaper(self):
+        self._reaper_stop.set()
+        if self._reaper is not None:
+            self._reaper.join()
+            self._reaper = None
+
+    def close_all(self):
+        with self._registry_lock:
+            db_names = list(self._clients)
+        for db_name in db_names:
+            self.close_client(db_name)
+
+    def create_collection(self, client, collection_name, index_type=None, metric_type=None, index_params=None,
+                          search_params=None):
+        """
+        Create a collection if it does not exist yet. Index settings left as None fall back to
+        ``Config.VECTOR_INDEX_TYPE`` / ``Config.VECTOR_METRIC_TYPE`` and the per-index-type defaults.
+        """
+        if client.has_collection(collection_name):
+            return
+        settings = self._resolve_index_settings(index_type, metric_type, index_params, search_params)
+        self._validate_index_settings(settings)
+        schema = client.create_schema(auto_id=False, enable_dynamic_field=True)
+        schema.add_field("id", DataType.INT64, is_primary=True)
+        schema.add_field("vector", DataType.FLOAT_VECTOR, dim=Config.EMBEDDING_DIMENSION)
+        client.create_collection(collection_name, schema=schema, index_params=self._index_params(client, settings))
+        self._save_index_settings(client, collection_name, settings)
+
+    @staticmethod
+    def _resolve_index_settings(index_type=None, metric_type=None, index_params=None, search_params=None):
+        index_type = (index_type or Config.VECTOR_INDEX_TYPE).upper()
+        return {
+            "index_type": index_type,
+            "metric_type": (metric_type or Config.VECTOR_METRIC_TYPE).upper(),
+            "index_params": dict(Config.VECTOR_INDEX_PARAMS.get(index_type, {}) if index_params is None else index_params),
+            "search_params": dict(Config.VECTOR_SEARCH_PARAMS.get(index_type, {}) if search_params is None else search_params),
+        }
+
+    @staticmethod
+    def _validate_index_settings(settings):
+        """
+        :raises ValueError: If the index type, metric or params are not ones Milvus accepts.
+        """
+        if settings["index_type"] not in INDEX_BUILD_PARAMS:
+            raise ValueError(f"Unsupported index_type '{settings['index_type']}', expected one of "
+                             + ", ".join(INDEX_BUILD_PARAMS))
+        if settings["metric_type"] not in METRIC_TYPES:
+            raise ValueError(f"Unsupported metric_type '{settings['metric_type']}', expected one of " + ", ".join(METRIC_TYPES))
+        unknown = [name for name in settings["index_params"] if name not in INDEX_BUILD_PARAMS[settings["index_type"]]]
+        if unknown:
+            raise ValueError(f"Unknown index_params for {settings['index_type']}: {', '.join(unknown)}")
+        for name, value in settings["index_params"].items():
+            valid = isinstance(value, bool) if name == "with_raw_data" else (
+                isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0)
+            if not valid:
+                raise ValueError(f"Invalid index_params.{name}: {value!r}")
 
-    def search(self, client, collection_name, query_vector, top_k):    
+    @staticmethod
+    def _index_params(client, settings):
+        index_params = client.prepare_index_params()
+        index_params.add_index(field_name="vector", index_name="vector", index_type=settings["index_type"],
+                               metric_type=settings["metric_type"], params=settings["index_params"])
+        return index_params
+
+    def _save_index_settings(self, client, collection_name, settings):
+        # 索引参数和默认搜索参数作为集合属性保存，随集合一起持久化和删除
+        client.alter_collection_properties(collection_name, properties={"index_settings": json.dumps(settings)})
+        self._settings_cache[(id(client), collection_name)] = settings
+
+    def get_index_settings(self, client, collection_name):
+        """
+        :return: ``index_type``, ``metric_type``, ``index_params`` and default ``search_params`` of a collection.
+        """
+        key = (id(client), collection_name)
+        settings = self._settings_cache.get(key)
+        if settings is None:
+            properties = client.describe_collection(collection_name).get("properties") or {}
+            if "index_settings" in properties:
+                settings = json.loads(properties["index_settings"])
+            else:
+                # 旧集合没有保存设置，按实际索引类型取默认值
+                index = client.describe_index(collection_name, index_name="vector")
+                settings = self._resolve_index_settings(index["index_type"], index["metric_type"], index_params={})
+            self._settings_cache[key] = settings
+        return settings
+
+    def set_index(self, client, collection_name, index_type=None, metric_type=None, index_params=None,
+                  search_params=None):
+        """
+        Change the index and default search params of a collection. Settings left as None keep their
+        current value; the index is rebuilt only when its type, metric or build params change.
+        If the new index cannot be built or loaded, the old one is restored.
+
+        :return: The new settings.
+        :raises ValueError: If the new settings are invalid; the collection is left untouched.
+        """
+        current = self.get_index_settings(client, collection_name)
+        if index_type is not None and index_type.upper() != current["index_type"]:
+            # 换了索引类型时，没有指定的参数用新类型的默认值
+            settings = self._resolve_index_settings(index_type, metric_type or current["metric_type"],
+                                                    index_params, search_params)
+        else:
+            settings = {
+                "index_type": current["index_type"],
+                "metric_type": (metric_type or current["metric_type"]).upper(),
+                "index_params": current["index_params"] if index_params is None else dict(index_params),
+                "search_params": current["search_params"] if search_params is None else dict(search_params),
+            }
+        self._validate_index_settings(settings)
+        if any(settings[name] != current[name] for name in ("index_type", "metric_type", "index_params")):
+            client.release_collection(collection_name)
+            client.drop_index(collection_name, index_name="vector")
+            try:
+                client.create_index(collection_name, self._index_params(client, settings))
+                client.load_collection(collection_name)
+            except Exception:
+                # 新索引建不起来时恢复原来的索引并重新加载，集合保持可查询
+                client.release_collection(collection_name)
+                if "vector" in client.list_indexes(collection_name):
+                    client.drop_index(collection_name, index_name="vector")
+                client.create_index(collection_name, self._index_params(client, current))
+                client.load_collection(collection_name)
+                raise
+        self._save_index_settings(client, collection_name, settings)
+        return settings
+
+    def insert_data(self, client, collection_name, texts, embeddings, ids, metadatas=None,
+                    batch_size=Config.MILVUS_INSERT_BATCH_SIZE):
+        """
+        Upsert chunks in batches of ``batch_size`` rows.
+
+        :param texts: Chunk texts.
+        :param embeddings: Float32 matrix with one row per chunk.
+        :param ids: Primary keys of the chunks.
+        :param metadatas: Per-chunk dicts of ``METADATA_FIELDS`` stored alongside the text.
+        :return: Number of rows written.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or len(embeddings) != len(texts) or len(ids) != len(texts):
+            raise ValueError(f"Expected {len(texts)} ids and a ({len(texts)}, dim) embedding matrix, "
+                             f"got {len(ids)} ids and {embeddings.shape}")
+        metadatas = metadatas or [{}] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            end = min(start + batch_size, len(texts))
+            data = [
+                {"id": int(ids[i]), "vector": embeddings[i], "text": texts[i],
+                 **{field: metadatas[i][field] for field in METADATA_FIELDS if field in metadatas[i]}}
+                for i in range(start, end)
+            ]
+            # ids 由分块内容决定，重复写入同一分块时覆盖而不是产生重复行
+            client.upsert(collection_name, data)
+        return len(texts)
+
+    def update_metadata(self, client, collection_name, ids, metadatas, batch_size=Config.MILVUS_INSERT_BATCH_SIZE):
+        """
+        Rewrite the ``METADATA_FIELDS`` of stored chunks, keeping their text and vector.
+
+        :param ids: Primary keys of the chunks.
+        :param metadatas: New metadata of each chunk.
+        :return: Number of rows rewritten; ids missing from the collection are skipped.
+        """
+        updated = 0
+        for start in range(0, len(ids), batch_size):
+            batch = {int(chunk_id): metadata for chunk_id, metadata in zip(ids[start:start + batch_size], metadatas[start:start + batch_size])}
+            # upsert 会整行替换，先取回文本和向量
+            rows = client.get(collection_name, ids=list(batch), output_fields=["text", "vector"])
+            data = [
+                {"id": row["id"], "vector": np.asarray(row["vector"], dtype=np.float32), "text": row["text"],
+                 **{field: batch[row["id"]][field] for field in METADATA_FIELDS if field in batch[row["id"]]}}
+                for row in rows
+            ]
+            if data:
+                client.upsert(collection_name, data)
+            updated += len(data)
+        return updated
+
+    def delete_data(self, client, collection_name, ids):
+        if ids:
+            client.delete(collection_name, ids=list(ids))
+
+    def drop_collection(self, client, collection_name):
+        self._settings_cache.pop((id(client), collection_name), None)
+        if client.has_collection(collection_name):
+            client.drop_collection(collection_name)
+
+    def search(self, client, collection_name, query_vector, top_k, search_params=None):
+        """
+        :param search_params: Index search params such as ``nprobe`` or ``ef``, overriding the collection defaults.
+        """
+        params = {**self.get_index_settings(client, collection_name)["search_params"], **(search_params or {})}
         results = client.search(
             collection_name=collection_name,  # target collection
             data=query_vector,  # query vectors
             limit=top_k,  # number of returned entities
-            output_fields=["text", "subject"],  # specifies fields to be returned
+            output_fields=["text", *METADATA_FIELDS],  # specifies fields to be returned
+            search_params={"params": params},
         )
         return results
 
+    def list_collections(self, client):
+        return [name for name in client.list_collections() if not name.startswith(RESERVED_COLLECTION_PREFIX)]
+
+    def get_metric_type(self, client, collection_name):
+        return self.get_index_settings(client, collection_name)["metric_type"]
+
+    def search_collections(self, client, collection_names, query_vector, top_k, search_params=None):
+        """
+        Search several collections concurrently and merge the per-collection top-k of each query
+        into a global top-k. Every hit gets a ``collection`` field naming its source collection.
+
+        :raises ValueError: If the collections use different metric types, whose distances are not comparable.
+        """
+        if not collection_names:
+            return [[] for _ in range(len(query_vector))]
+        metric_types = {collection_name: self.get_metric_type(client, collection_name) for collection_name in collection_names}
+        if len(set(metric_types.values())) > 1:
+            raise ValueError("Cannot merge results of collections with different metric types: "
+                             + ", ".join(f"{name} ({metric})" for name, metric in metric_types.items())
+                             + "; search them separately or give them the same metric_type")
+        futures = [
+            self._search_executor.submit(self.search, client, collection_name, query_vector, top_k, search_params)
+            for collection_name in collection_names
+        ]
+        per_collection = [future.result() for future in futures]
+        if len(collection_names) == 1:
+            return [[dict(hit, collection=collection_names[0]) for hit in hits] for hits in per_collection[0]]
+
+        # COSINE / IP 距离越大越相似，L2 越小越相似
+        larger_is_closer = metric_types[collection_names[0]] != "L2"
+        select = heapq.nlargest if larger_is_closer else heapq.nsmallest
+        merged = []
+        for i in range(len(query_vector)):
+            hits = (
+                dict(hit, collection=collection_name)
+                for collection_name, results in zip(collection_names, per_collection)
+                for hit in results[i]
+            )
+            merged.append(select(top_k, hits, key=lambda hit: hit["distance"]))
+        return merged
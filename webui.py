@@ -5,11 +5,28 @@ from PIL import Image
 from io import BytesIO
 import os
 import shutil
+import time
+import json
 
 API_BASE_URL = "http://localhost:5000"  # 替换为你的API服务器地址
 
 uploaded_files = {}
 
+def wait_for_jobs(jobs, poll_interval=1.0):
+    # 文档上传后在后台入库，轮询任务状态直到全部结束
+    errors = []
+    for job in jobs:
+        while True:
+            status = requests.get(f"{API_BASE_URL}/jobs/{job['job_id']}").json()
+            print(f"{job['file_name']}: {status['status']} {status['stage']} {status['progress']}")
+            if status['status'] == 'succeeded':
+                break
+            if status['status'] == 'failed':
+                errors.append(f"{job['file_name']}: {status['error']}")
+                break
+            time.sleep(poll_interval)
+    return errors
+
 def upload_file(file_path):
     file_name = os.path.basename(file_path)
     _, file_ext = os.path.splitext(file_name)
@@ -34,21 +51,33 @@ def upload_file(file_path):
     print(f"Response Text: {response.text}")  # 打印响应文本
 
     if response.status_code == 200:
+        errors = wait_for_jobs(response.json().get('jobs', []))
+        if errors:
+            return f"Failed to process file: {'; '.join(errors)}"
         uploaded_files[file_name] = file_path
         return list(uploaded_files.keys())
     else:
         return f"Failed to upload file: {response.text}"
 
-def query_api(query, table_file_name, doc_file_name):
-    url = f"{API_BASE_URL}/query"
+def query_api_stream(query, table_file_name, doc_file_name):
+    # 调用流式接口，逐个返回 (事件名, 数据)
+    url = f"{API_BASE_URL}/query/stream"
     data = {
         'query': query,
         'db_name': 'test',  # 默认数据库名称
         'table_file_name': table_file_name,
         'doc_file_name': doc_file_name,
     }
-    response = requests.post(url, data=data)
-    return response.json()
+    with requests.post(url, data=data, stream=True) as response:
+        if response.status_code != 200:
+            yield 'error', {'detail': response.text}
+            return
+        event = None
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event: '):
+                event = line[len('event: '):]
+            elif line.startswith('data: '):
+                yield event, json.loads(line[len('data: '):])
 
 def respond(message, sources, chat_history):
     table_file_name = None
@@ -60,17 +89,24 @@ def respond(message, sources, chat_history):
         else:
             doc_file_name = os.path.splitext(source)[0]
     
-    result = query_api(message, table_file_name, doc_file_name)
-    
-    if result.get('image'):
-        # 解析Base64编码的图片
-        image_data = base64.b64decode(result['image'])
-        image = Image.open(BytesIO(image_data))
-        chat_history.append((message, gr.Image(value=image, label="Result Image")))
-    else:
-        answer = result.get('answer', 'No answer received.')
-        chat_history.append((message, answer))
-    return "", chat_history
+    # 回答按 token 流式追加到最后一条消息
+    chat_history.append((message, ""))
+    answer = ""
+    for event, data in query_api_stream(message, table_file_name, doc_file_name):
+        if event == 'image':
+            # 解析Base64编码的图片
+            image_data = base64.b64decode(data['image'])
+            image = Image.open(BytesIO(image_data))
+            chat_history[-1] = (message, gr.Image(value=image, label="Result Image"))
+        elif event == 'token':
+            answer += data['content']
+            chat_history[-1] = (message, answer)
+        elif event == 'error':
+            chat_history[-1] = (message, f"{answer}\n\n[Error] {data['detail']}")
+        yield "", chat_history
+    if chat_history[-1][1] == "":
+        chat_history[-1] = (message, 'No answer received.')
+        yield "", chat_history
 
 def validate_selection(selected_files):
     table_count = 0